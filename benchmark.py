@@ -0,0 +1,363 @@
+#! /usr/bin/python3
+
+# Benchmarks for gentorrent and gennfo
+#
+# All inputs are synthetic and generated locally from a fixed seed: no network
+# access and no real media file is needed, MediaInfo being replaced by a stub.
+# Each case runs in a fresh interpreter so that its peak RSS is its own.
+#
+# Typical usage:
+#   ./benchmark.py --save baseline.json
+#   ./benchmark.py --compare baseline.json
+
+
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import tracemalloc
+import types
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from hashlib import sha1
+from io import StringIO
+from multiprocessing import get_context
+from time import perf_counter
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+import gentorrent
+
+
+SEED = 42
+MiB = 1024 * 1024
+
+# name -> setup function, in definition order
+cases = OrderedDict()
+
+
+def case(name):
+    """Register a benchmark case.
+
+    The decorated function is called as setup(workdir, scale), and must
+    return a (run, size) tuple, where run is the callable to time and size
+    is the number of bytes it processes.
+
+    """
+    def register(setup):
+        cases[name] = setup
+        return setup
+    return register
+
+
+def random_bytes(size, seed=SEED):
+    return random.Random(seed).randbytes(size)
+
+
+def write_file(filename, size, seed=SEED):
+    with open(filename, 'wb') as f:
+        remaining = size
+        while remaining:
+            block = min(remaining, 16 * MiB)
+            f.write(random_bytes(block, seed))
+            remaining -= block
+            seed += 1
+
+
+def nested_structure(depth, width):
+    """Build a nested structure of dicts and lists, depth levels deep"""
+    leaf = {b"length": 123456789, b"path": [b"some", b"file.mkv"]}
+    for level in range(depth):
+        if level % 2:
+            leaf = [leaf] * width
+        else:
+            leaf = {("key%d" % i).encode('ascii'): leaf for i in range(width)}
+    return leaf
+
+
+def big_structure(scale):
+    """Build a torrent-like structure with many files and a large pieces blob"""
+    files = [{b"length": i * 1000,
+              b"path": [b"dir%d" % (i % 100), b"file%d.mkv" % i]}
+             for i in range(20000 * scale)]
+    pieces = random_bytes(20 * 50000 * scale)
+    return {b"announce": b"http://tracker.example.com/announce",
+            b"info": {b"files": files, b"name": b"pack",
+                      b"piece length": 256 * 1024, b"pieces": pieces}}
+
+
+@case("bencode-large")
+def bencode_large(workdir, scale):
+    data = big_structure(scale)
+    size = len(gentorrent.bencode(data))
+    return (lambda: gentorrent.bencode(data)), size
+
+
+@case("bdecode-large")
+def bdecode_large(workdir, scale):
+    data = bytes(gentorrent.bencode(big_structure(scale)))
+    return (lambda: gentorrent.bdecode(data)), len(data)
+
+
+@case("bencode-nested")
+def bencode_nested(workdir, scale):
+    data = nested_structure(5, 8 + 2 * scale)
+    size = len(gentorrent.bencode(data))
+    return (lambda: gentorrent.bencode(data)), size
+
+
+@case("bdecode-nested")
+def bdecode_nested(workdir, scale):
+    data = bytes(gentorrent.bencode(nested_structure(5, 8 + 2 * scale)))
+    return (lambda: gentorrent.bdecode(data)), len(data)
+
+
+@case("hash-single")
+def hash_single(workdir, scale):
+    filename = os.path.join(workdir, "single.bin")
+    size = 128 * MiB * scale
+    write_file(filename, size)
+    filename = os.fsencode(filename)
+    return (lambda: gentorrent.Metainfo(filename)), size
+
+
+@case("hash-single-sync")
+def hash_single_sync(workdir, scale):
+    # Same as hash-single, without read-ahead
+    filename = os.path.join(workdir, "single.bin")
+    size = 128 * MiB * scale
+    write_file(filename, size)
+    filename = os.fsencode(filename)
+    return (lambda: gentorrent.Metainfo(filename, readahead=0)), size
+
+
+@case("hash-many")
+def hash_many(workdir, scale):
+    dirname = os.path.join(workdir, "many")
+    rng = random.Random(SEED)
+    size = 0
+    for i in range(2000 * scale):
+        subdir = os.path.join(dirname, "sub%d" % (i % 20))
+        os.makedirs(subdir, exist_ok=True)
+        length = rng.randrange(1, 64 * 1024)
+        write_file(os.path.join(subdir, "file%d" % i), length, seed=i)
+        size += length
+    dirname = os.fsencode(dirname)
+    return (lambda: gentorrent.Metainfo(dirname, piece_length=32 * 1024)), size
+
+
+def write_sparse_file(filename, size, dense=False, seed=SEED):
+    """Write a file of size bytes, mostly zeros, as recorders preallocate
+    them: 1 MiB of data every 16 MiB, from an offset that is not aligned on
+    pieces, the rest being holes unless dense is set"""
+    with open(filename, 'wb') as f:
+        if dense:
+            for offset in range(0, size, 16 * MiB):
+                f.write(bytes(min(16 * MiB, size - offset)))
+        else:
+            f.truncate(size)
+        for offset in range(12345, size - MiB, 16 * MiB):
+            f.seek(offset)
+            f.write(random_bytes(MiB, seed + offset))
+
+
+@case("hash-sparse")
+def hash_sparse(workdir, scale):
+    filename = os.path.join(workdir, "sparse.bin")
+    size = 512 * MiB * scale
+    write_sparse_file(filename, size)
+    filename = os.fsencode(filename)
+    return (lambda: gentorrent.Metainfo(filename)), size
+
+
+@case("hash-sparse-dense")
+def hash_sparse_dense(workdir, scale):
+    # Same content as hash-sparse, with its zeros written on disk
+    filename = os.path.join(workdir, "dense.bin")
+    size = 512 * MiB * scale
+    write_sparse_file(filename, size, dense=True)
+    filename = os.fsencode(filename)
+    return (lambda: gentorrent.Metainfo(filename)), size
+
+
+def merkle_root_in_place(pieces):
+    """Merkle root computation as gentorrent did it before MerkleTree:
+    the whole leaf list is reduced in place, level by level"""
+    padding = 20 * b"\0"
+    while len(pieces) > 20:
+        if len(pieces) % 40:
+            pieces.extend(padding)
+        for i in range(0, len(pieces) // 2, 20):
+            pieces[i:i + 20] = sha1(pieces[2*i:2*i + 40]).digest()
+        del pieces[len(pieces)//2:]
+        padding = sha1(2 * padding).digest()
+    return pieces
+
+
+@case("merkle-in-place")
+def merkle_in_place(workdir, scale):
+    # A bit more than a million leaves, so that the tree needs padding
+    leaves = random_bytes(20 * (1000000 * scale + 1))
+    return (lambda: merkle_root_in_place(bytearray(leaves))), len(leaves)
+
+
+@case("merkle-streaming")
+def merkle_streaming(workdir, scale):
+    leaves = random_bytes(20 * (1000000 * scale + 1))
+    def run():
+        tree = gentorrent.MerkleTree()
+        for i in range(0, len(leaves), 20):
+            tree.add(leaves[i:i + 20])
+        return tree.root()
+    assert run() == merkle_root_in_place(bytearray(leaves))
+    return run, len(leaves)
+
+
+class StubMediaInfo:
+    """Stand-in for MediaInfoDLL3.MediaInfo, returning canned values"""
+
+    values = {"Format": "Matroska", "Width": "1920", "Height": "1080",
+              "FrameRate": "23.976", "BitRate": "8000000",
+              "Duration/String1": "1h 42mn", "Standard": "",
+              "Channel(s)": "6", "SamplingRate": "48000"}
+
+    def Open(self, File):
+        self.filename = File
+        return 1
+
+    def Option_Static(self, Option, Value=""):
+        return ""
+
+    def GetI(self, StreamKind, StreamNumber, Parameter, InfoKind=0):
+        return self.filename
+
+    def Get(self, StreamKind, StreamNumber, Parameter, InfoKind=0,
+            SearchKind=0):
+        if Parameter == "FileSize":
+            return str(os.path.getsize(self.filename))
+        return self.values.get(Parameter, "")
+
+    def Close(self):
+        pass
+
+
+def import_gennfo():
+    """Import gennfo on top of a stub MediaInfoDLL3 module"""
+    stub = types.ModuleType("MediaInfoDLL3")
+    stub.MediaInfo = StubMediaInfo
+    stub.Stream = types.SimpleNamespace(General=0, Video=1, Audio=2)
+    stub.__all__ = ["MediaInfo", "Stream"]
+    sys.modules["MediaInfoDLL3"] = stub
+    import gennfo
+    return gennfo
+
+
+@case("nfo")
+def nfo(workdir, scale):
+    gennfo = import_gennfo()
+    filenames = []
+    for i in range(200 * scale):
+        filename = os.path.join(workdir, "video%d.mkv" % i)
+        write_file(filename, 1024, seed=i)
+        filenames.append(filename)
+    def run():
+        with redirect_stdout(StringIO()):
+            for filename in filenames:
+                gennfo.gen_nfo(filename)
+    return run, 1024 * len(filenames)
+
+
+def max_rss():
+    """Return the peak resident set size of this process, in bytes"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss
+    return rss * 1024
+
+
+def run_case(name, scale, repeat):
+    """Run a single case, in the current process, and return its results"""
+    with tempfile.TemporaryDirectory(prefix="gentorrent-bench-") as workdir:
+        run, size = cases[name](workdir, scale)
+        timings = []
+        for i in range(repeat):
+            start = perf_counter()
+            run()
+            timings.append(perf_counter() - start)
+        # A last traced run to measure allocations, that would otherwise
+        # slow down the timed runs
+        tracemalloc.start()
+        run()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    best = min(timings)
+    return {"size": size,
+            "best": best,
+            "mean": sum(timings) / len(timings),
+            "throughput": size / best if best else None,
+            "alloc_peak": peak,
+            "max_rss": max_rss()}
+
+
+def compare(results, baseline):
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["best"] / baseline[name]["best"]
+        print("%-16s %6.2fx %s" % (name, ratio,
+                                   "slower" if ratio > 1 else "faster"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark gentorrent and gennfo on synthetic inputs')
+    parser.add_argument('--case', '-k', action='append', choices=list(cases),
+                        help='case to run; use several times to run several\
+                        cases (defaults to all)')
+    parser.add_argument('--scale', '-s', type=int, default=1, metavar='N',
+                        help='multiply the size of the inputs by N')
+    parser.add_argument('--repeat', '-r', type=int, default=3, metavar='N',
+                        help='number of timed runs per case, the best one\
+                        being kept (defaults to 3)')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as JSON, for later comparison')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a saved baseline')
+    args = parser.parse_args()
+    names = args.case or list(cases)
+    results = OrderedDict()
+    # Each case runs in a freshly spawned interpreter, so that peak RSS and
+    # allocations are not inherited from previous cases
+    context = get_context('spawn')
+    for name in names:
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            result = executor.submit(run_case, name, args.scale, args.repeat).result()
+        results[name] = result
+        rss = result["max_rss"]
+        print("%-16s %9.4f s %9.1f MiB/s  alloc peak %8.1f MiB  max RSS %s"
+              % (name, result["best"], (result["throughput"] or 0) / MiB,
+                 result["alloc_peak"] / MiB,
+                 "%.1f MiB" % (rss / MiB) if rss else "n/a"))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({"python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "scale": args.scale,
+                       "repeat": args.repeat,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
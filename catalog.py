@@ -0,0 +1,402 @@
+#! /usr/bin/python3
+
+# A catalog of generated torrents and NFO metadata
+#
+# The catalog is an SQLite database, indexed by infohash, name, size and
+# content path, filled after each generation by gentorrent (--catalog),
+# torrentd (--catalog) and the GUI (SEEDAVIDEO_CATALOG environment variable),
+# or by importing existing metainfo files.
+#
+# Generated torrents are also recorded with a quick fingerprint of their
+# content (cf. gentorrent.fingerprint), computed from the blocks read to
+# hash it, so that a content already published, even under another name or
+# path, is recognized without hashing it again (gentorrent --reuse).
+#
+# Typical usage:
+#   ./catalog.py catalog.db import torrents/*.torrent
+#   ./catalog.py catalog.db find --name 'Some.Movie.*'
+#   ./catalog.py catalog.db find --path /srv/seed/video.mkv
+#   ./catalog.py catalog.db find --like /srv/incoming/video.mkv
+
+
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+from hashlib import sha1
+from time import time
+
+import gentorrent
+from gentorrent import bdecode, bspans, reuse_info
+
+# Default catalog, for the programs that do not take it as an argument
+CATALOG_ENV = 'SEEDAVIDEO_CATALOG'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS torrents (
+    infohash TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    piece_length INTEGER,
+    content_path TEXT,
+    torrent_path TEXT,
+    added INTEGER NOT NULL,
+    nfo TEXT,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS torrents_name ON torrents (name);
+CREATE INDEX IF NOT EXISTS torrents_size ON torrents (size);
+CREATE INDEX IF NOT EXISTS torrents_content_path ON torrents (content_path);
+"""
+
+# Created once the fingerprint column exists, in catalogs predating it
+INDEXES = """
+CREATE INDEX IF NOT EXISTS torrents_fingerprint ON torrents (fingerprint);
+"""
+
+COLUMNS = ('infohash', 'name', 'size', 'piece_length', 'content_path',
+           'torrent_path', 'added', 'nfo', 'fingerprint')
+
+# Columns kept when a row is recorded again without them
+KEPT = ('piece_length', 'content_path', 'torrent_path', 'nfo', 'fingerprint')
+
+
+def _text(value):
+    """Convert names and paths to str that SQLite can store: bytes that are
+    not UTF-8, and the surrogates os.fsdecode makes of them, are replaced
+    with U+FFFD
+
+    >>> _text(b'caf\\xc3\\xa9'), _text(b'caf\\xe9'), _text(os.fsdecode(b'caf\\xe9'))
+    ('café', 'caf\ufffd', 'caf\ufffd')
+
+    """
+    if isinstance(value, str):
+        try:
+            value = value.encode('utf-8', 'surrogateescape')
+        except UnicodeEncodeError:
+            value = value.encode('utf-8', 'replace')
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def torrent_row(data):
+    """Extract the catalog fields of a bencoded metainfo file, without
+    decoding nor re-encoding its pieces
+
+    Return: (infohash, name, size, piece_length)
+
+    >>> data = (b'd8:announce14:http://a/annce4:infod6:lengthi4e4:name4:spam'
+    ...         b'12:piece lengthi16384e6:pieces20:' + 20 * b'x' + b'ee')
+    >>> torrent_row(data)
+    ('9a28c9e3cbf1e90e12faa1c0784b56199c2a346a', b'spam', 4, 16384)
+
+    """
+    spans = bspans(data)
+    start, end = spans[b"info"]
+    info = bspans(data, start)
+    def decode(key, default=None):
+        if key not in info:
+            return default
+        return bdecode(data[info[key][0]:info[key][1]])
+    if b"length" in info:
+        size = decode(b"length")
+    else:
+        size = sum(filedict[b"length"] for filedict in decode(b"files", []))
+    return (sha1(memoryview(data)[start:end]).hexdigest(),
+            decode(b"name", b""), size, decode(b"piece length"))
+
+
+class Catalog:
+    """A catalog of torrents
+
+    Positional argument:
+    filename -- SQLite database file, created if needed
+
+    The catalog can be shared between threads.
+
+    >>> from gentorrent import Metainfo
+    >>> catalog = Catalog(':memory:')
+    >>> info = {b"name": b"spam", b"length": 4, b"piece length": 16384, b"pieces": 20 * b"x"}
+    >>> metainfo = Metainfo.from_info(info)
+    >>> catalog.add(metainfo, '/srv/spam', '/srv/spam.torrent', {'video_codec': 'AVC'})
+    >>> [tuple(row) for row in catalog.find(name='sp*')]  # doctest: +ELLIPSIS
+    [('9a28c9e3cbf1e90e12faa1c0784b56199c2a346a', 'spam', 4, 16384, '/srv/spam', '/srv/spam.torrent', ..., '{"video_codec": "AVC"}', None)]
+
+    Recording a known torrent again keeps the fields it does not give, e.g.
+    when its metainfo file is imported:
+
+    >>> catalog._insert([(metainfo.infohash, 'spam', 4, None, None, '/tmp/spam.torrent', 0, None, None)], ['spam.torrent'])
+    []
+    >>> row = catalog.find(infohash=metainfo.infohash.upper())[0]
+    >>> row['content_path'], row['torrent_path'], row['nfo']
+    ('/srv/spam', '/tmp/spam.torrent', '{"video_codec": "AVC"}')
+    >>> catalog.find(size=5), len(catalog.find(size=4, content_path='/srv/spam'))
+    ([], 1)
+
+    """
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            # Let readers run while a generation is being recorded
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript(SCHEMA)
+            columns = [row['name'] for row in
+                       self.db.execute("PRAGMA table_info(torrents)")]
+            if 'fingerprint' not in columns:
+                self.db.execute("ALTER TABLE torrents ADD COLUMN fingerprint TEXT")
+            self.db.executescript(INDEXES)
+
+    def close(self):
+        self.db.close()
+
+    def _insert(self, rows, filenames=None):
+        """Insert or update rows, in one transaction
+
+        If the transaction fails and filenames, the files the rows come from,
+        are given, the rows are inserted one by one instead, and the list of
+        (filename, error) of the rows that failed is returned.
+
+        """
+        # Known torrents keep the fields the new rows do not have, e.g. the
+        # content path and NFO of a generated torrent that is then imported
+        query = ("INSERT INTO torrents (%s) VALUES (%s) "
+                 "ON CONFLICT (infohash) DO UPDATE SET %s"
+                 % (", ".join(COLUMNS), ", ".join("?" * len(COLUMNS)),
+                    ", ".join("%s = COALESCE(excluded.%s, %s)"
+                              % (column, column, column) for column in KEPT)))
+        try:
+            with self.lock, self.db:
+                self.db.executemany(query, rows)
+            return []
+        except (sqlite3.Error, ValueError) as e:
+            if filenames is None:
+                raise
+        errors = []
+        for row, filename in zip(rows, filenames):
+            try:
+                with self.lock, self.db:
+                    self.db.execute(query, row)
+            except (sqlite3.Error, ValueError) as e:
+                errors.append((filename, e))
+        return errors
+
+    def add(self, metainfo, content_path=None, torrent_path=None, nfo=None,
+            fingerprint=None):
+        """Record a generated torrent
+
+        Positional argument:
+        metainfo     -- the Metainfo
+
+        Optional arguments:
+        content_path -- file or directory the torrent was generated from
+        torrent_path -- metainfo file it was written to
+        nfo          -- dictionary of NFO fields, as returned by gen_nfo
+        fingerprint  -- fingerprint of the content (defaults to the one of the
+                        Metainfo, computed while hashing, if any: the content is
+                        not read again)
+
+        """
+        if fingerprint is None:
+            fingerprint = getattr(metainfo, 'fingerprint', None)
+        info = metainfo.info
+        if b"length" in info:
+            size = info[b"length"]
+        else:
+            size = sum(filedict[b"length"] for filedict in info.get(b"files", []))
+        self._insert([(metainfo.infohash, _text(info[b"name"]), size,
+                       info.get(b"piece length"), _text(content_path),
+                       _text(torrent_path), int(time()),
+                       json.dumps(nfo) if nfo else None, fingerprint)])
+
+    def import_files(self, filenames, batch=1000):
+        """Import existing metainfo files, in batches of one transaction
+
+        Return: the number of imported files, and a list of (filename,
+        error) for the files that could not be imported
+
+        """
+        rows = []
+        batch_filenames = []
+        imported = 0
+        errors = []
+        now = int(time())
+        def insert():
+            failed = self._insert(rows, batch_filenames)
+            errors.extend(failed)
+            return len(rows) - len(failed)
+        for filename in filenames:
+            try:
+                with open(filename, 'rb') as f:
+                    infohash, name, size, piece_length = torrent_row(f.read())
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                errors.append((filename, e))
+                continue
+            rows.append((infohash, _text(name), size, piece_length, None,
+                         _text(os.path.abspath(filename)), now, None, None))
+            batch_filenames.append(filename)
+            if len(rows) >= batch:
+                imported += insert()
+                rows = []
+                batch_filenames = []
+        imported += insert()
+        return imported, errors
+
+    def find(self, infohash=None, name=None, size=None, content_path=None,
+             fingerprint=None, limit=None):
+        """Look torrents up; all given criteria must match
+
+        Keyword arguments:
+        infohash     -- hexadecimal infohash
+        name         -- name, or GLOB pattern on the name
+        size         -- total size, in bytes
+        content_path -- file or directory the torrent was generated from
+        fingerprint  -- fingerprint of the content (cf. gentorrent.fingerprint)
+        limit        -- maximum number of results
+
+        Return: a list of sqlite3.Row
+
+        """
+        clauses = []
+        params = []
+        if infohash:
+            clauses.append("infohash = ?")
+            params.append(infohash.lower())
+        if name:
+            clauses.append("name GLOB ?")
+            params.append(_text(name))
+        if size is not None:
+            clauses.append("size = ?")
+            params.append(size)
+        if content_path:
+            clauses.append("content_path = ?")
+            params.append(os.path.abspath(_text(content_path)))
+        if fingerprint:
+            clauses.append("fingerprint = ?")
+            params.append(fingerprint)
+        query = "SELECT * FROM torrents"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY added DESC"
+        if limit:
+            query += " LIMIT %d" % limit
+        with self.lock:
+            return self.db.execute(query, params).fetchall()
+
+    def reuse(self, filename, piece_length=None, private=False, merkle=False,
+              md5sum=False, fingerprint=None):
+        """Build the info dictionary of a content from a known torrent of the
+        same content, found by its fingerprint, instead of hashing it
+
+        Positional argument:
+        filename     -- file or directory
+
+        Optional arguments:
+        piece_length -- required piece length (defaults to any)
+        private      -- set the private flag (default to False)
+        merkle       -- require a Merkle torrent (default to False)
+        md5sum       -- require the MD5 hashes of the files (default to False)
+        fingerprint  -- fingerprint of the content, if already computed
+
+        Return: the info dictionary, or None if no usable torrent is known:
+        the metainfo file of the known torrent must still exist and describe
+        the same files, and the requested options
+
+        """
+        if fingerprint is None:
+            fingerprint = gentorrent.fingerprint(filename)
+        for row in self.find(fingerprint=fingerprint):
+            if not row['torrent_path'] or \
+               (piece_length and row['piece_length'] != piece_length):
+                continue
+            try:
+                with open(row['torrent_path'], 'rb') as f:
+                    info = bdecode(f.read())[b"info"]
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            # The metainfo file may have been overwritten since
+            if (b"root hash" in info) != bool(merkle) or \
+               (piece_length and info.get(b"piece length") != piece_length):
+                continue
+            info = reuse_info(info, filename, private, md5sum)
+            if info is not None:
+                return info
+        return None
+
+
+def record(filename, metainfo, content_path=None, torrent_path=None, nfo=None):
+    """Record a generated torrent in a catalog, if filename is set"""
+    if not filename:
+        return
+    if content_path:
+        content_path = os.path.abspath(content_path)
+    if torrent_path:
+        torrent_path = os.path.abspath(torrent_path)
+    catalog = Catalog(filename)
+    try:
+        catalog.add(metainfo, content_path, torrent_path, nfo)
+    finally:
+        catalog.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query and fill a catalog of torrents')
+    parser.add_argument('catalog', metavar='DB', help='catalog file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser_import = subparsers.add_parser('import', help='import existing\
+                                          metainfo files')
+    parser_import.add_argument('filenames', nargs='*', metavar='FILE',
+                               help='metainfo files to import; with no FILE,\
+                               or when FILE is -, read file names from\
+                               standard input, one per line')
+    parser_find = subparsers.add_parser('find', help='look torrents up')
+    parser_find.add_argument('--infohash', '-i', help='hexadecimal infohash')
+    parser_find.add_argument('--name', '-n', help='name, or GLOB pattern on\
+                             the name (e.g. "Some.Movie.*")')
+    parser_find.add_argument('--size', '-s', type=int, help='total size, in\
+                             bytes')
+    parser_find.add_argument('--path', '-p', help='file or directory the\
+                             torrent was generated from')
+    parser_find.add_argument('--like', metavar='PATH', help='file or\
+                             directory whose content is probably the same, by\
+                             fingerprint')
+    parser_find.add_argument('--limit', '-l', type=int, metavar='N',
+                             help='maximum number of results')
+    parser_find.add_argument('--nfo', action='store_true',
+                             help='also print the NFO fields')
+    args = parser.parse_args()
+    catalog = Catalog(args.catalog)
+    if args.command == 'import':
+        def filenames():
+            for filename in args.filenames or ['-']:
+                if filename == '-':
+                    for line in sys.stdin:
+                        line = line.rstrip('\n')
+                        if line:
+                            yield line
+                else:
+                    yield filename
+        imported, errors = catalog.import_files(filenames())
+        for filename, error in errors:
+            print("%s: %s" % (filename, error), file=sys.stderr)
+        print("%d metainfo files imported" % imported)
+        return 1 if errors else 0
+    rows = catalog.find(args.infohash, args.name, args.size, args.path,
+                        args.like and gentorrent.fingerprint(args.like), args.limit)
+    for row in rows:
+        print("\t".join(str(row[column]) for column in
+                        ('infohash', 'size', 'name', 'content_path', 'torrent_path')))
+        if args.nfo and row['nfo']:
+            for key, value in json.loads(row['nfo']).items():
+                print("\t%s: %s" % (key, value))
+    return 0 if rows else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
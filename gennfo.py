@@ -5,19 +5,99 @@
 import os
 from MediaInfoDLL3 import *
 
-def gen_nfo(fichier):
+# Valeur de Open_Buffer_Continue_GoTo_Get quand MediaInfo ne demande pas à
+# lire ailleurs dans le fichier
+PAS_DE_SAUT = 2**64 - 1
 
-	MI = MediaInfo()
+class AnalyseFlux:
+	"""Analyse d'un fichier par MediaInfo à partir de blocs lus par un autre
+	traitement, par exemple la copie de gentorrent.ingest, sans relire le
+	fichier. S'utilise comme consommateur de blocs : analyse(index, bloc).
 
-	print("Ouverture du fichier par la DLL MediaInfo")
-	MI.Open(fichier)
-	print("Fait")
+	Les blocs arrivent dans l'ordre : si MediaInfo demande à lire ailleurs
+	dans le fichier, l'analyse est abandonnée (complete reste à False) et
+	il faut ouvrir le fichier normalement."""
+
+	def __init__(self, taille, MI=None):
+		if MI is None:
+			MI = MediaInfo()
+		self.MI = MI
+		self.MI.Open_Buffer_Init(taille, 0)
+		self.active = True
+		self.complete = False
+
+	def __call__(self, index, bloc):
+		if not self.active or bloc is None:
+			return
+		etat = self.MI.Open_Buffer_Continue(bloc)
+		if self.MI.Open_Buffer_Continue_GoTo_Get() != PAS_DE_SAUT:
+			# MediaInfo veut lire ailleurs : impossible pendant une copie
+			self.active = False
+		elif etat & 0x08:
+			# Analyse terminée, inutile de lire la suite
+			self.active = False
+			self.complete = True
+
+	def termine(self):
+		self.MI.Open_Buffer_Finalize()
+		if self.active:
+			# Tout le fichier a été lu
+			self.active = False
+			self.complete = True
+		return self.complete
+
+def analyse_stockage(stockage, nom, MI, taille_bloc=1024*1024):
+	"""Analyse d'un fichier d'un stockage (cf. storage.py) par MediaInfo, en
+	lisant des plages du fichier, sans le copier : contrairement à
+	AnalyseFlux, les sauts demandés par MediaInfo sont suivis."""
+	taille = stockage.stat(nom).size
+	MI.Open_Buffer_Init(taille, 0)
+	position = 0
+	while position < taille:
+		bloc = stockage.read(nom, position, min(taille_bloc, taille - position))
+		if not bloc:
+			break
+		etat = MI.Open_Buffer_Continue(bloc)
+		if etat & 0x08:
+			# Analyse terminée, inutile de lire la suite
+			break
+		saut = MI.Open_Buffer_Continue_GoTo_Get()
+		if saut != PAS_DE_SAUT:
+			# MediaInfo veut lire ailleurs, par exemple l'index à la fin
+			position = saut
+			MI.Open_Buffer_Init(taille, position)
+		else:
+			position += len(bloc)
+	MI.Open_Buffer_Finalize()
+
+def gen_nfo(fichier, MI=None, analyse=None, stockage=None, sortie=None):
+
+	# Une instance MediaInfo peut être fournie, pour être réutilisée d'un
+	# appel à l'autre
+	if MI is None:
+		MI = MediaInfo()
+
+	if stockage is not None:
+		# Fichier distant : fichier est son nom dans le stockage
+		print("Analyse du fichier par la DLL MediaInfo, à distance")
+		analyse_stockage(stockage, fichier, MI)
+		print("Fait")
+	elif analyse is not None and analyse.termine():
+		# Le fichier a déjà été analysé pendant sa lecture par ailleurs
+		MI = analyse.MI
+	else:
+		print("Ouverture du fichier par la DLL MediaInfo")
+		MI.Open(fichier)
+		print("Fait")
 
 	MI.Option_Static("Complete")
 
 	print("Récupération des informations pour le NFO")
 	# Chemin du fichier
 	FileName = MI.GetI(Stream.General, 0, 46)
+	if not FileName:
+		# Analyse d'un flux : MediaInfo ne connaît pas le nom du fichier
+		FileName = os.path.basename(fichier)
 	FileName = FileName.split("/")
 	Morceau = len(FileName) - 1
 	FileName = FileName[Morceau]
@@ -49,8 +129,8 @@ def gen_nfo(fichier):
 
 	MI.Close()
 
-	# Création du fichier NFO
-	fichier = fichier + ".nfo"
+	# Création du fichier NFO, à côté du fichier sauf si sortie est donné
+	fichier = sortie or fichier + ".nfo"
 	print("Création du fichier .nfo")
 	nfo = open(fichier, "w")
 	print("Fait")
@@ -63,4 +143,7 @@ def gen_nfo(fichier):
 
 	print("Fermeture du fichier .nfo")
 	nfo.close()
-	print("Fait")
\ No newline at end of file
+	print("Fait")
+
+	# Les informations du NFO, pour le catalogue
+	return {"name": FileName, "video_codec": FormatVideo, "resolution": Resolution, "frame_rate": FrameRate, "bitrate": BitRate, "runtime": Duree, "standard": standard, "size_mb": FileSize, "audio_codec": FormatAudio, "channels": Channel, "sampling_rate": SamplingRate}
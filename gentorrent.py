@@ -19,14 +19,22 @@
 
 
 import argparse
+import errno
 import locale
 import re
 import os
+import socket
+import socketserver
+import sys
+import threading
 from io import BytesIO
 from collections import OrderedDict
 from hashlib import sha1, md5
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty, Queue
 from urllib.parse import urlencode
-from time import time
+from time import time, perf_counter
 from os import path
 
 os_sep = os.sep.encode('ascii')
@@ -188,7 +196,7 @@ def bencode(data, buf=None):
         raise TypeError("str are not supported, please encode to bytes")
     elif isinstance(data, Bencoded) or isinstance(data, BencodedArray):
         buf.extend(data)
-    elif isinstance(data, bytes) or isinstance(data, bytearray):
+    elif isinstance(data, (bytes, bytearray, memoryview)):
         buf.extend(("%d" % len(data)).encode('ascii'))
         buf.extend(b':')
         buf.extend(data)
@@ -244,11 +252,1453 @@ class BencodedArray(bytearray):
     pass
 
 
+class HashWriter:
+    """A write-only buffer feeding bencoded data to a hash object
+
+    It can be given to bencode as a buffer, to hash bencoded data as it is
+    produced instead of building a copy of it first.
+
+    >>> h = sha1()
+    >>> buf = bencode({b"spam": [b"a", b"b"]}, HashWriter(h))
+    >>> h.digest() == sha1(b'd4:spaml1:a1:bee').digest()
+    True
+
+    """
+
+    def __init__(self, hash):
+        self.hash = hash
+        self.extend = hash.update
+
+
+def infohash(info):
+    """Return the infohash of an info dictionary, as an hexadecimal str
+
+    The dictionary is bencoded as a stream into SHA-1, so that no bencoded
+    copy of it, including its pieces, is kept in memory.
+
+    >>> infohash({b"name": b"spam", b"length": 4}) == sha1(b'd6:lengthi4e4:name4:spame').hexdigest()
+    True
+
+    """
+    h = sha1()
+    bencode(info, HashWriter(h))
+    return h.hexdigest()
+
+
+def bspan(data, offset=0):
+    """Find the end of a bencoded value, without decoding it.
+
+    Positional argument:
+    data   -- bencoded data, as bytes or bytearray
+
+    Optional argument:
+    offset -- where the value starts (default to zero)
+
+    Return: the offset just past the end of the value
+
+    >>> bspan(b'4:spami3e')
+    6
+    >>> bspan(b'd4:spaml1:a1:bee3:fooi0e', 1)
+    7
+    >>> bspan(b'd4:spaml1:a1:bee')
+    16
+    >>> bspan(b'l4:spam')
+    Traceback (most recent call last):
+        ...
+    ValueError: premature end of bencoded data
+
+    """
+    depth = 0
+    try:
+        while True:
+            magic = data[offset]
+            if 48 <= magic <= 57:
+                # This is a string: skip its length and content
+                separator = data.index(b':', offset)
+                offset = separator + 1 + int(data[offset:separator])
+                if offset > len(data):
+                    raise IndexError
+            elif magic == 105:  # b'i'
+                offset = data.index(b'e', offset) + 1
+            elif magic == 100 or magic == 108:  # b'd' or b'l'
+                depth += 1
+                offset += 1
+                continue
+            elif magic == 101 and depth:  # b'e'
+                depth -= 1
+                offset += 1
+            else:
+                raise ValueError("this is not valid bencoded data")
+            if not depth:
+                return offset
+    except IndexError:
+        raise ValueError("premature end of bencoded data")
+
+
+def bspans(data, offset=0):
+    """Locate the values of a bencoded dictionary, without decoding them.
+
+    Positional argument:
+    data   -- bencoded data, as bytes or bytearray
+
+    Optional argument:
+    offset -- where the dictionary starts (default to zero)
+
+    Return: a dictionary mapping keys to the (start, end) offsets of the
+    corresponding bencoded values
+
+    >>> sorted(bspans(b'd3:cow3:moo4:spaml1:a1:bee').items())
+    [(b'cow', (6, 11)), (b'spam', (17, 25))]
+
+    """
+    if data[offset:offset + 1] != b'd':
+        raise ValueError("this is not a valid bencoded dict (syntax is b'd<keys and values>e')")
+    spans = {}
+    offset += 1
+    while data[offset:offset + 1] != b'e':
+        end = bspan(data, offset)
+        key = bytes(data[data.index(b':', offset) + 1:end])
+        offset = bspan(data, end)
+        spans[key] = (end, offset)
+    return spans
+
+
+def magnet_link(name, infohash, length=None, announce=None, url_list=None):
+    """Build a magnet link.
+
+    Positional arguments:
+    name     -- display name, as bytes
+    infohash -- infohash, as an hexadecimal str
+
+    Optional arguments:
+    length   -- length of the content, for single-file torrents
+    announce -- list of list of tracker announce URL (cf. Metainfo)
+    url_list -- list of HTTP/FTP seeding URLs (cf. Metainfo)
+
+    >>> magnet_link(b"spam", "0123456789abcdef0123456789abcdef01234567", 4, [[b"http://tracker.example.com/announce"]])
+    'magnet:?dn=spam&xl=4&xt=0123456789abcdef0123456789abcdef01234567&tr=http%3A%2F%2Ftracker.example.com%2Fannounce'
+
+    """
+    params = OrderedDict()
+    params[b'dn'] = name
+    if length :
+        params[b'xl'] = ("%d" % length).encode('ascii')
+    params[b'xt'] = infohash
+    params[b'tr'] = []
+    if announce:
+        for tracker_list in announce:
+            for tracker in tracker_list:
+                params[b'tr'].append(tracker)
+    params[b'as'] = []
+    if url_list:
+        for url in url_list:
+            params[b'as'].append(url)
+    return "magnet:?%s" % urlencode(params, doseq=True)
+
+
+def torrent_magnet(data):
+    """Build the magnet link of a bencoded metainfo file.
+
+    The infohash is computed on the raw bytes of the info dictionary, which
+    is never decoded nor re-encoded: only the few fields needed by the
+    magnet link are decoded.
+
+    Positional argument:
+    data -- content of the metainfo file, as bytes
+
+    Return: the magnet link, as a str
+
+    >>> info = {b"name": b"spam", b"length": 4, b"piece length": 16384, b"pieces": sha1(b"spam").digest()}
+    >>> data = bytes(bencode({b"announce": b"http://tracker.example.com/announce", b"info": info}))
+    >>> torrent_magnet(data) == magnet_link(b"spam", infohash(info), 4, [[b"http://tracker.example.com/announce"]])
+    True
+
+    """
+    spans = bspans(data)
+    if b"info" not in spans:
+        raise ValueError("this is not a valid metainfo file (no info dictionary)")
+    def decode(spans, key, default=None):
+        if key not in spans:
+            return default
+        start, end = spans[key]
+        return bdecode(data[start:end])
+    start, end = spans[b"info"]
+    info_spans = bspans(data, start)
+    announce = decode(spans, b"announce-list")
+    if not announce and b"announce" in spans:
+        announce = [[decode(spans, b"announce")]]
+    url_list = decode(spans, b"url-list")
+    if isinstance(url_list, bytes):
+        url_list = [url_list]
+    return magnet_link(decode(info_spans, b"name", b""),
+                       sha1(memoryview(data)[start:end]).hexdigest(),
+                       decode(info_spans, b"length"), announce, url_list)
+
+
+class HashStats:
+    """Instrumentation gathered while hashing the content of a torrent
+
+    Attributes:
+    bytes_read -- number of bytes read from the files
+    io_time    -- time (in seconds) spent waiting for reads
+    hash_time  -- time (in seconds) spent computing SHA-1 and MD5 hashes
+    pieces     -- number of pieces completed
+    files      -- list of (filename, length, io_time, hash_time), one per file,
+                  in hashing order
+    elapsed    -- wall-clock time (in seconds) from start to stop
+    callback   -- optional callable, called with this object each time a
+                  piece is completed
+
+    >>> stats = HashStats()
+    >>> stats.bytes_read, stats.pieces, stats.files
+    (0, 0, [])
+
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.bytes_read = 0
+        self.io_time = 0.0
+        self.hash_time = 0.0
+        self.pieces = 0
+        self.files = []
+        self.started = None
+        self.elapsed = 0.0
+
+    def start(self):
+        self.started = perf_counter()
+
+    def stop(self):
+        self.elapsed = perf_counter() - self.started
+
+    def piece_done(self, count=1):
+        self.pieces += count
+        if self.callback:
+            self.callback(self)
+
+    @property
+    def throughput(self):
+        """Bytes hashed per second of wall-clock time"""
+        if not self.elapsed:
+            return 0.0
+        return self.bytes_read / self.elapsed
+
+    def summary(self):
+        """Return a human-readable report of the statistics"""
+        mib = 1024 * 1024
+        lines = ["Read %d bytes in %.3f s (%.1f MiB/s), %d pieces"
+                 % (self.bytes_read, self.elapsed, self.throughput / mib,
+                    self.pieces)]
+        lines.append("I/O: %.3f s, hashing: %.3f s (%s-bound)"
+                     % (self.io_time, self.hash_time,
+                        "disk" if self.io_time > self.hash_time else "CPU"))
+        for filename, length, io_time, hash_time in self.files:
+            if isinstance(filename, bytes):
+                filename = filename.decode('utf-8', 'replace')
+            lines.append("  %s: %d bytes, I/O %.3f s, hashing %.3f s"
+                         % (filename, length, io_time, hash_time))
+        return "\n".join(lines)
+
+
+class PieceHasher:
+    """Split a stream of data into pieces and compute their SHA-1 hashes
+
+    Data can be fed by chunks of any size: a piece may span several chunks,
+    and several files in directory mode. Chunks of zeros from _zeros, read
+    from holes of sparse files, are not hashed: whole pieces of zeros get a
+    precomputed hash.
+
+    Positional argument:
+    piece_length -- length (in bytes) of the pieces
+
+    Optional arguments:
+    stats        -- HashStats instance to update (default to None)
+    pieces       -- where to store the piece hashes, an object with a
+                    put(index, digest) method such as PieceStore or MerkleTree
+                    (by default, a growing PieceStore)
+
+    >>> hasher = PieceHasher(4)
+    >>> hasher.update(b'spam')
+    >>> hasher.update(b'eg')
+    >>> hasher.update(b'gsham')
+    >>> pieces = hasher.digest()
+    >>> pieces == sha1(b'spam').digest() + sha1(b'eggs').digest() + sha1(b'ham').digest()
+    True
+    >>> hasher = PieceHasher(4)
+    >>> hasher.update(b'sp')
+    >>> hasher.update(_zeros(10))
+    >>> pieces = hasher.digest()
+    >>> pieces == sha1(b'sp' + bytes(2)).digest() + 2 * sha1(bytes(4)).digest()
+    True
+
+    """
+
+    def __init__(self, piece_length, stats=None, pieces=None):
+        self.piece_length = piece_length
+        self.stats = stats
+        if pieces is None:
+            pieces = PieceStore()
+        self.pieces = pieces
+        self.index = 0
+        self.partial = bytearray()
+
+    def update(self, data):
+        piece_length = self.piece_length
+        view = memoryview(data)
+        if self.partial:
+            # Complete the piece started by the previous chunks
+            missing = piece_length - len(self.partial)
+            self.partial += view[:missing]
+            view = view[missing:]
+            if len(self.partial) < piece_length:
+                return
+            self._hash(self.partial)
+            self.partial = bytearray()
+        if view.obj is _zero_buffer and len(view) >= piece_length:
+            # Whole pieces in a hole
+            count = len(view) // piece_length
+            self._zero_pieces(count)
+            view = view[count * piece_length:]
+        while len(view) >= piece_length:
+            self._hash(view[:piece_length])
+            view = view[piece_length:]
+        if view:
+            self.partial += view
+
+    def _hash(self, piece):
+        stats = self.stats
+        if stats:
+            start = perf_counter()
+            self.pieces.put(self.index, sha1(piece).digest())
+            stats.hash_time += perf_counter() - start
+            stats.piece_done()
+        else:
+            self.pieces.put(self.index, sha1(piece).digest())
+        self.index += 1
+
+    def _zero_pieces(self, count):
+        digest = _zero_digests.get(self.piece_length)
+        if digest is None:
+            digest = sha1(bytes(self.piece_length)).digest()
+            _zero_digests[self.piece_length] = digest
+        for index in range(self.index, self.index + count):
+            self.pieces.put(index, digest)
+        self.index += count
+        if self.stats:
+            self.stats.piece_done(count)
+
+    def digest(self):
+        """Hash the last, incomplete piece if any, and return the pieces
+        store"""
+        if self.partial:
+            self._hash(self.partial)
+            self.partial = bytearray()
+        return self.pieces
+
+
+class PieceStore(bytearray):
+    """Storage for piece hashes, written by piece index
+
+    The store can be preallocated from the number of pieces, which is known
+    from the total length, so that hashes can be written in place, in any
+    order, without reallocating. Writing past the end grows the store. As a
+    bytearray, it can be given as is to bencode.
+
+    Optional argument:
+    count -- number of pieces to preallocate (default to zero)
+
+    >>> store = PieceStore(2)
+    >>> store.put(1, sha1(b'eggs').digest())
+    >>> store.put(0, sha1(b'spam').digest())
+    >>> store == sha1(b'spam').digest() + sha1(b'eggs').digest()
+    True
+    >>> store.put(2, sha1(b'ham').digest())
+    >>> len(store)
+    60
+
+    """
+
+    def __init__(self, count=0):
+        super().__init__(20 * count)
+
+    @staticmethod
+    def count(length, piece_length):
+        """Return the number of pieces needed for length bytes"""
+        return -(-length // piece_length)
+
+    def put(self, index, digest):
+        offset = 20 * index
+        if offset < len(self):
+            # Preallocated slot: same-size slice assignment, in place
+            self[offset:offset + 20] = digest
+        else:
+            if offset > len(self):
+                self.extend(bytes(offset - len(self)))
+            self.extend(digest)
+
+
+class MerkleTree:
+    """Compute the root hash of a Merkle hash tree (cf. BEP-30)
+
+    Leaves are given one at a time, and reduced as soon as possible: only one
+    pending hash is kept per level of the tree, so memory usage is O(log n)
+    for n leaves. When the number of leaves is not a power of two, the tree
+    is padded with zeros, or recursive hashes of zeros when climbing the
+    tree, as required by BEP-30.
+
+    >>> a, b, c = b'a' * 20, b'b' * 20, b'c' * 20
+    >>> tree = MerkleTree()
+    >>> tree.add(a)
+    >>> tree.root() == a
+    True
+    >>> tree.put(2, c)
+    >>> tree.put(1, b)
+    >>> tree.root() == sha1(sha1(a + b).digest() + sha1(c + 20 * b"\\0").digest()).digest()
+    True
+
+    """
+
+    def __init__(self):
+        # levels[i] is the hash of a complete subtree of 2**i leaves, still
+        # waiting for its right sibling, or None
+        self.levels = []
+        self.count = 0
+        # Leaves given out of order, by index
+        self.waiting = {}
+
+    def put(self, index, digest):
+        """Add a leaf given its index: leaves given out of order are kept
+        aside until all the previous ones are known"""
+        if index != self.count:
+            self.waiting[index] = digest
+            return
+        self.add(digest)
+        while self.count in self.waiting:
+            self.add(self.waiting.pop(self.count))
+
+    def add(self, digest):
+        """Add the next leaf"""
+        self.count += 1
+        levels = self.levels
+        for level, pending in enumerate(levels):
+            if pending is None:
+                levels[level] = digest
+                return
+            # Two siblings: climb one level up
+            digest = sha1(pending + digest).digest()
+            levels[level] = None
+        levels.append(digest)
+
+    def root(self):
+        """Return the root hash of the tree (empty if there is no leaf)"""
+        if self.waiting:
+            raise ValueError("missing leaves before leaf %d" % min(self.waiting))
+        levels = self.levels
+        if not levels:
+            return b""
+        top = len(levels) - 1
+        padding = 20 * b"\0"
+        # Hash of the rightmost, incomplete subtree, padded up to the
+        # current level
+        node = None
+        for level, pending in enumerate(levels):
+            if level == top:
+                if node is None:
+                    # The number of leaves is a power of two
+                    return pending
+                return sha1(pending + node).digest()
+            if pending is not None:
+                node = sha1(pending + (padding if node is None else node)).digest()
+            elif node is not None:
+                node = sha1(node + padding).digest()
+            # The padding at the next level is the result of hashing two
+            # padding hashes together, cf. BEP-30.
+            padding = sha1(2 * padding).digest()
+
+
+def _advise(f, offset, length, advice):
+    """Give an access pattern hint to the kernel, where supported"""
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(f.fileno(), offset, length, getattr(os, advice))
+        except OSError:
+            # Hints are only hints: some filesystems do not support them
+            pass
+
+
+# Shared buffer of zeros, standing for the holes of sparse files
+_zero_buffer = b""
+# Hashes of pieces of zeros, by piece length
+_zero_digests = {}
+
+
+def _zeros(length):
+    """Return a read-only view of length zeros, on a shared buffer, which
+    PieceHasher recognizes"""
+    global _zero_buffer
+    if len(_zero_buffer) < length:
+        _zero_buffer = bytes(length)
+    return memoryview(_zero_buffer)[:length]
+
+
+def _holes(f):
+    """List the holes of a sparse file, as sorted (start, end) offsets,
+    using SEEK_HOLE and SEEK_DATA where supported
+
+    The file position is reset to the start of the file.
+
+    """
+    if not hasattr(os, 'SEEK_HOLE'):
+        return []
+    fd = f.fileno()
+    size = os.fstat(fd).st_size
+    holes = []
+    offset = 0
+    try:
+        while offset < size:
+            start = os.lseek(fd, offset, os.SEEK_HOLE)
+            if start >= size:
+                # Only the virtual hole at the end of the file
+                break
+            try:
+                end = min(os.lseek(fd, start, os.SEEK_DATA), size)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                # No more data after this hole
+                end = size
+            holes.append((start, end))
+            offset = end
+    except OSError:
+        # Not supported by this filesystem
+        holes = []
+    f.seek(0)
+    return holes
+
+
+def _hole_split(holes, start, end):
+    """Split the range [start, end) of a file into (start, end, hole) parts,
+    where hole tells whether the part is in one of holes
+
+    >>> _hole_split([(4, 8), (12, 20)], 2, 14)
+    [(2, 4, False), (4, 8, True), (8, 12, False), (12, 14, True)]
+    >>> _hole_split([(4, 8), (12, 20)], 13, 16)
+    [(13, 16, True)]
+
+    """
+    parts = []
+    position = start
+    i = max(bisect_right(holes, (start,)) - 1, 0)
+    while i < len(holes) and holes[i][0] < end:
+        hole_start, hole_end = holes[i]
+        i += 1
+        if hole_end <= position:
+            continue
+        if hole_start > position:
+            parts.append((position, hole_start, False))
+        position = min(hole_end, end)
+        parts.append((max(hole_start, start), position, True))
+    if position < end:
+        parts.append((position, end, False))
+    return parts
+
+
+def _read_sparse(f, buf, start, end, holes):
+    """Read the range [start, end) of a sparse file into buf, reading only
+    its data
+
+    Return: list of the views the range is made of, in order: views on buf
+    for its data, and views on the shared buffer of zeros for its holes, so
+    that consumers can tell them apart (e.g. to keep a copy sparse)
+
+    """
+    view = memoryview(buf)
+    blocks = []
+    for part_start, part_end, hole in _hole_split(holes, start, end):
+        if hole:
+            blocks.append(_zeros(part_end - part_start))
+        else:
+            f.seek(part_start)
+            offset = part_start
+            while offset < part_end:
+                # unbuffered files may return less than asked for
+                count = f.readinto(view[offset - start:part_end - start])
+                if not count:
+                    raise OSError("%s is shorter than expected (end of file at %d)"
+                                  % (os.fsdecode(f.name), offset))
+                offset += count
+            blocks.append(view[part_start - start:part_end - start])
+    return blocks
+
+
+def _read_files(paths, block_size, stats=None):
+    """Generate the content of files by blocks of block_size bytes
+
+    Positional arguments:
+    paths      -- list of the files to read
+    block_size -- maximum size of the blocks
+
+    Optional argument:
+    stats      -- HashStats instance to update (default to None)
+
+    Generate: (index, block) tuples, where index is the index of the file
+    in paths, and block is None at the end of each file; blocks in the holes
+    of sparse files are views of zeros (cf. _zeros), and blocks are split
+    where holes start and end
+
+    """
+    for index, filename in enumerate(paths):
+        with open(filename, mode='rb') as f:
+            _advise(f, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+            holes = _holes(f)
+            if holes:
+                size = os.fstat(f.fileno()).st_size
+                for offset in range(0, size, block_size):
+                    length = min(block_size, size - offset)
+                    if stats:
+                        start = perf_counter()
+                        chunks = _read_sparse(f, bytearray(length), offset,
+                                              offset + length, holes)
+                        stats.io_time += perf_counter() - start
+                        stats.bytes_read += length
+                    else:
+                        chunks = _read_sparse(f, bytearray(length), offset,
+                                              offset + length, holes)
+                    for chunk in chunks:
+                        yield index, chunk
+                yield index, None
+                continue
+            while True:
+                if stats:
+                    start = perf_counter()
+                    chunk = f.read(block_size)
+                    stats.io_time += perf_counter() - start
+                    stats.bytes_read += len(chunk)
+                else:
+                    chunk = f.read(block_size)
+                if len(chunk) == 0:
+                    break
+                yield index, chunk
+        yield index, None
+
+
+class ReadAhead:
+    """Read files in a background thread, ahead of their consumer
+
+    Files are read into a ring of reusable buffers, so that the disk keeps
+    working while the consumer hashes the previous blocks. The kernel is
+    told that files are read sequentially, asked to prefetch the blocks
+    following the ones being read, and to drop from its page cache the ones
+    already read, so that reading a large content does not evict the rest
+    of the page cache.
+
+    Positional arguments:
+    paths      -- list of the files to read
+    block_size -- size of the buffers
+
+    Optional arguments:
+    depth      -- number of buffers (default to 4)
+    stats      -- HashStats instance to update (default to None): the I/O time
+                  is the time the consumer spent waiting for blocks
+
+    Iterating over it generates (index, block) tuples as _read_files does,
+    but blocks are memoryviews on the buffers, only valid until the next
+    iteration. The holes of sparse files are not read (cf. _read_sparse).
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile() as f:
+    ...     length = f.write(b'spam and eggs')
+    ...     f.flush()
+    ...     [(index, block and bytes(block)) for index, block in ReadAhead([f.name], 8)]
+    [(0, b'spam and'), (0, b' eggs'), (0, None)]
+
+    """
+
+    def __init__(self, paths, block_size, depth=4, stats=None):
+        self.paths = paths
+        self.block_size = block_size
+        self.stats = stats
+        self.free = Queue()
+        for i in range(depth):
+            self.free.put(bytearray(block_size))
+        self.filled = Queue()
+        self.stopped = False
+
+    def _read(self):
+        block_size = self.block_size
+        window = block_size * self.free.qsize()
+        try:
+            for index, filename in enumerate(self.paths):
+                with open(filename, mode='rb', buffering=0) as f:
+                    _advise(f, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+                    holes = _holes(f)
+                    if holes:
+                        if not self._read_holes(index, f, holes):
+                            return
+                        continue
+                    offset = 0
+                    while True:
+                        buf = self.free.get()
+                        if self.stopped:
+                            return
+                        _advise(f, offset + block_size, window, 'POSIX_FADV_WILLNEED')
+                        length = f.readinto(buf)
+                        if not length:
+                            self.free.put(buf)
+                            break
+                        self.filled.put((index, buf, [memoryview(buf)[:length]]))
+                        # This part of the file is in our buffer now
+                        _advise(f, offset, length, 'POSIX_FADV_DONTNEED')
+                        offset += length
+                self.filled.put((index, None, None))
+            self.filled.put(None)
+        except BaseException as e:
+            self.filled.put(e)
+
+    def _read_holes(self, index, f, holes):
+        """Read a sparse file, without reading its holes; return False if
+        the consumer stopped"""
+        block_size = self.block_size
+        size = os.fstat(f.fileno()).st_size
+        for offset in range(0, size, block_size):
+            # Views of zeros take no buffer, but wait for one all the same,
+            # not to run ahead of the consumer
+            buf = self.free.get()
+            if self.stopped:
+                return False
+            length = min(block_size, size - offset)
+            blocks = _read_sparse(f, buf, offset, offset + length, holes)
+            self.filled.put((index, buf, blocks))
+            _advise(f, offset, length, 'POSIX_FADV_DONTNEED')
+        self.filled.put((index, None, None))
+        return True
+
+    def __iter__(self):
+        stats = self.stats
+        thread = threading.Thread(target=self._read, daemon=True)
+        thread.start()
+        try:
+            while True:
+                if stats:
+                    start = perf_counter()
+                    item = self.filled.get()
+                    stats.io_time += perf_counter() - start
+                else:
+                    item = self.filled.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                index, buf, blocks = item
+                if buf is None:
+                    yield index, None
+                    continue
+                for block in blocks:
+                    if stats:
+                        # Counted here, not by the reader running ahead
+                        stats.bytes_read += len(block)
+                    yield index, block
+                # The consumer is done with this buffer, recycle it
+                self.free.put(buf)
+        finally:
+            # Stop the reader, if the consumer stopped early
+            self.stopped = True
+            self.free.put(bytearray())
+            thread.join()
+
+
+def _layout(filename, storage=None):
+    """List the files of a content to be distributed
+
+    Positional argument:
+    filename -- name of the file or directory to be distributed
+
+    Optional argument:
+    storage  -- storage the content is in (cf. storage.py; defaults to the
+                local filesystem)
+
+    Return: (layout, paths, lengths), where layout is an incomplete info
+    dictionary, holding the name and the length or files list of the
+    content, paths is the list of the files to read, in order, and lengths
+    the list of their lengths
+
+    """
+    if storage is not None:
+        return _storage_layout(filename, storage)
+    layout = {}
+    layout[b"name"] = path.basename(path.normpath(filename))
+    paths = []
+    lengths = []
+    if path.isfile(filename):
+        layout[b"length"] = path.getsize(filename)
+        paths.append(filename)
+        lengths.append(layout[b"length"])
+    elif path.isdir(filename):
+        dirname = filename
+        layout[b"files"] = []
+        files = layout[b"files"]
+        for dirpath, dirnames, filenames in os.walk(dirname):
+            for filename in filenames:
+                filedict = {}
+                filename = path.join(dirpath, filename)
+                filedict[b"path"] = path.relpath(filename, dirname).split(os_sep)
+                filedict[b"length"] = path.getsize(filename)
+                files.append(filedict)
+                paths.append(filename)
+                lengths.append(filedict[b"length"])
+    return layout, paths, lengths
+
+
+def _storage_layout(name, storage):
+    """_layout for a content in a storage, named with "/" separators"""
+    name = name.rstrip('/')
+    layout = {}
+    layout[b"name"] = os.fsencode(name.rsplit('/', 1)[-1])
+    stat = storage.stat(name)
+    if not stat.isdir:
+        layout[b"length"] = stat.size
+        return layout, [name], [stat.size]
+    layout[b"files"] = []
+    paths = []
+    lengths = []
+    for relname, length in storage.list(name):
+        layout[b"files"].append({b"path": [os.fsencode(part) for part in relname.split('/')],
+                                 b"length": length})
+        paths.append(name + '/' + relname if name else relname)
+        lengths.append(length)
+    return layout, paths, lengths
+
+
+def _hasher(piece_length, total, merkle=False, stats=None):
+    """Create a PieceHasher for total bytes, storing its hashes in a
+    preallocated PieceStore, or in a MerkleTree"""
+    if merkle:
+        # Merkle torrent: leaves are reduced as they are computed,
+        # instead of being stored
+        return PieceHasher(piece_length, stats, MerkleTree())
+    return PieceHasher(piece_length, stats,
+                       PieceStore(PieceStore.count(total, piece_length)))
+
+
+def _hash_files(paths, hashers, md5sum=False, stats=None, block_size=None,
+                readahead=4, consumers=(), storage=None):
+    """Feed the content of files to one or several PieceHasher
+
+    The files are read only once, by blocks of a multiple of the largest
+    piece length: as piece lengths are usually powers of two, the smaller
+    ones then divide the block size, so that every hasher hashes its pieces
+    in place, as slices of the same blocks.
+
+    Positional arguments:
+    paths      -- list of the files to hash, in order
+    hashers    -- list of PieceHasher to feed
+
+    Optional arguments:
+    md5sum     -- also compute the MD5 hash of the files (default to False)
+    stats      -- HashStats instance to update (default to None)
+    block_size -- size of the reads (default to the largest piece length,
+                  rounded up to 4 mebi with read-ahead)
+    readahead  -- number of blocks read ahead by a background thread, or 0
+                  to read in the hashing thread (default to 4)
+    consumers  -- callables also given every (index, block) tuple read, e.g.
+                  to copy the files while hashing them (cf. _read_files)
+    storage    -- storage the files are in, which then reads them (cf.
+                  storage.py; default to the local filesystem)
+
+    Return: the list of the hexadecimal MD5 hashes of the files as bytes,
+    or of None
+
+    """
+    piece_length = max(hasher.piece_length for hasher in hashers)
+    if not block_size:
+        block_size = piece_length
+        if readahead:
+            block_size *= max(1, 4*1024*1024 // piece_length)
+    if storage is not None:
+        blocks = storage.blocks(paths, block_size, stats)
+    elif readahead:
+        blocks = ReadAhead(paths, block_size, readahead, stats)
+    else:
+        blocks = _read_files(paths, block_size, stats)
+    md5sums = [None] * len(paths)
+    digest = md5() if md5sum else None
+    if stats:
+        io_time, hash_time = stats.io_time, stats.hash_time
+        file_length = 0
+    for index, block in blocks:
+        for consumer in consumers:
+            consumer(index, block)
+        if block is None:
+            # End of a file
+            if md5sum:
+                md5sums[index] = digest.hexdigest().encode('ascii')
+                digest = md5()
+            if stats:
+                stats.files.append((paths[index], file_length,
+                                    stats.io_time - io_time,
+                                    stats.hash_time - hash_time))
+                io_time, hash_time = stats.io_time, stats.hash_time
+                file_length = 0
+            continue
+        if stats:
+            file_length += len(block)
+        for hasher in hashers:
+            hasher.update(block)
+        if md5sum:
+            if stats:
+                start = perf_counter()
+                digest.update(block)
+                stats.hash_time += perf_counter() - start
+            else:
+                digest.update(block)
+    return md5sums
+
+
+class _Copier:
+    """Block consumer, writing the files read by _hash_files to new paths
+
+    Positional argument:
+    destinations -- list of the paths to write the files to
+
+    Optional argument:
+    stats        -- HashStats instance to update (default to None): the time
+                    spent writing is counted as I/O time
+
+    """
+
+    def __init__(self, destinations, stats=None):
+        self.destinations = destinations
+        self.stats = stats
+        self.file = None
+
+    def __call__(self, index, block):
+        if self.file is None:
+            dirname = path.dirname(self.destinations[index])
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            self.file = open(self.destinations[index], 'wb')
+        if block is None:
+            # End of the file
+            self.close()
+        elif isinstance(block, memoryview) and block.obj is _zero_buffer:
+            # Hole of a sparse file: keep the copy sparse
+            self.file.seek(len(block), os.SEEK_CUR)
+        elif self.stats:
+            start = perf_counter()
+            self.file.write(block)
+            self.stats.io_time += perf_counter() - start
+        else:
+            self.file.write(block)
+
+    def close(self):
+        if self.file is not None:
+            # Set the length, if the file ends with a hole
+            self.file.truncate()
+            self.file.close()
+            self.file = None
+
+
+def _info(layout, hasher, private=False, merkle=False, md5sums=None):
+    """Build an info dictionary
+
+    Positional arguments:
+    layout  -- layout of the content, as returned by _layout
+    hasher  -- PieceHasher fed with the whole content
+
+    Optional arguments:
+    private -- set the private flag (default to False)
+    merkle  -- the hasher stores its hashes in a MerkleTree (default to False)
+    md5sums -- list of the MD5 hashes of the files, to include
+
+    """
+    info = dict(layout)
+    info[b"piece length"] = hasher.piece_length
+    if private:
+        info[b"private"] = 1
+    if md5sums:
+        if b"files" in info:
+            info[b"files"] = []
+            for filedict, digest in zip(layout[b"files"], md5sums):
+                filedict = dict(filedict)
+                filedict[b"md5sum"] = digest
+                info[b"files"].append(filedict)
+        else:
+            info[b"md5sum"] = md5sums[0]
+    # Hash the last incomplete piece, if any
+    pieces = hasher.digest()
+    if merkle:
+        # Merkle torrent: the root of the hash tree is used in place
+        # of the pieces
+        info[b"root hash"] = pieces.root()
+    else:
+        # Regular torrent: we use the pieces directly
+        info[b"pieces"] = pieces
+    return info
+
+
+def _sample_offsets(length, samples=8, sample_size=256*1024):
+    """Offsets of the samples read from a file of length bytes by fingerprint:
+    the first and last sample_size bytes, and evenly spaced samples in
+    between, or the whole file if it is not larger than the samples
+
+    >>> _sample_offsets(10, 4, 4)
+    [0, 4, 8]
+    >>> _sample_offsets(100, 4, 4)
+    [0, 32, 64, 96]
+
+    """
+    if length <= samples*sample_size:
+        return list(range(0, length, sample_size))
+    stride = (length - sample_size) // (samples - 1)
+    return [i*stride for i in range(samples - 1)] + [length - sample_size]
+
+
+def fingerprint(filename, samples=8, sample_size=256*1024):
+    """Compute a quick fingerprint of a content, to recognize a content
+    already hashed without hashing it again
+
+    The fingerprint is the SHA-1 hash of the layout of the content (the paths
+    and lengths of its files, but not its name) and of a few samples of each
+    file, read at deterministic offsets (cf. _sample_offsets): at most
+    samples*sample_size bytes are read per file, whatever its size. It does
+    not depend on the piece length.
+
+    Two contents with the same fingerprint are very probably the same, but
+    a change outside the samples, e.g. a retagged file of the same size, is
+    not detected: check the pieces when in doubt (cf. reuse_info).
+
+    A content being hashed is better fingerprinted from the blocks read to
+    hash it (cf. _Fingerprinter, and the fingerprint argument of Metainfo).
+
+    Positional argument:
+    filename    -- name of the file or directory
+
+    Optional arguments:
+    samples     -- number of samples per file (default to 8)
+    sample_size -- size of the samples (default to 256 kibi)
+
+    Return: the hexadecimal fingerprint, as str
+
+    """
+    layout, paths, lengths = _layout(os.fsencode(filename))
+    del layout[b"name"]
+    digest = sha1(bytes(bencode(layout)))
+    for filename, length in zip(paths, lengths):
+        with open(filename, 'rb') as f:
+            for offset in _sample_offsets(length, samples, sample_size):
+                f.seek(offset)
+                digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+
+class _Fingerprinter:
+    """Block consumer, computing the fingerprint of a content from the
+    blocks read by _hash_files, without reading anything again
+
+    Positional arguments:
+    layout  -- layout of the content, as returned by _layout
+    lengths -- lengths of its files
+
+    Optional arguments: see fingerprint
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile() as f:
+    ...     length = f.write(bytes(range(256)) * 5000)
+    ...     f.flush()
+    ...     layout, paths, lengths = _layout(f.name)
+    ...     fingerprinter = _Fingerprinter(layout, lengths, 4, 1000)
+    ...     for index, block in _read_files(paths, 4096):
+    ...         fingerprinter(index, block)
+    ...     fingerprinter.hexdigest() == fingerprint(f.name, 4, 1000)
+    True
+
+    """
+
+    def __init__(self, layout, lengths, samples=8, sample_size=256*1024):
+        layout = dict(layout)
+        del layout[b"name"]
+        self.digest = sha1(bytes(bencode(layout)))
+        self.ranges = [[(offset, min(offset + sample_size, length))
+                        for offset in _sample_offsets(length, samples, sample_size)]
+                       for length in lengths]
+        # The last samples may overlap: they are collected separately, and
+        # hashed in order at the end of each file
+        self.samples = None
+        self.offset = 0
+
+    def __call__(self, index, block):
+        ranges = self.ranges[index]
+        if self.samples is None:
+            self.samples = [bytearray() for sample in ranges]
+        if block is None:
+            for sample in self.samples:
+                self.digest.update(sample)
+            self.samples = None
+            self.offset = 0
+            return
+        start = self.offset
+        end = start + len(block)
+        for (sample_start, sample_end), sample in zip(ranges, self.samples):
+            if sample_start < end and sample_end > start:
+                sample += block[max(sample_start, start) - start:
+                                min(sample_end, end) - start]
+        self.offset = end
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def reuse_info(info, filename, private=False, md5sum=False):
+    """Build the info dictionary of a content from the info dictionary of an
+    identical content, without hashing it: the pieces (or root hash), piece
+    length and MD5 hashes are taken from info, the name and private flag
+    are set as Metainfo would.
+
+    Positional arguments:
+    info     -- info dictionary of the known content, e.g. found by its
+                fingerprint
+    filename -- name of the file or directory
+
+    Optional arguments:
+    private  -- set the private flag (default to False)
+    md5sum   -- include the MD5 hash of the files, which must then be in info
+                (default to False)
+
+    Return: the info dictionary, or None if info does not describe a content
+    with the same files, in the same order, with the same lengths
+
+    Note: only the layout is compared; that the content is actually the same
+    is up to the caller (cf. fingerprint).
+
+    >>> import tempfile
+    >>> known = {b"name": b"spam", b"length": 4, b"piece length": 16384, b"pieces": sha1(b"spam").digest(), b"source": b"A"}
+    >>> with tempfile.NamedTemporaryFile() as f:
+    ...     length = f.write(b'spam')
+    ...     f.flush()
+    ...     info = reuse_info(known, f.name.encode())
+    ...     info[b"pieces"] == known[b"pieces"], b"source" in info, info[b"name"] == path.basename(f.name).encode()
+    (True, False, True)
+
+    """
+    layout, paths, lengths = _layout(os.fsencode(filename))
+    if b"files" in layout:
+        known = info.get(b"files") or []
+        if [(filedict[b"path"], filedict[b"length"]) for filedict in known] != \
+           [(filedict[b"path"], filedict[b"length"]) for filedict in layout[b"files"]]:
+            return None
+        md5sums = [filedict.get(b"md5sum") for filedict in known]
+    elif info.get(b"length") == layout.get(b"length"):
+        md5sums = [info.get(b"md5sum")]
+    else:
+        return None
+    new = dict(layout)
+    new[b"piece length"] = info[b"piece length"]
+    if private:
+        new[b"private"] = 1
+    if md5sum:
+        if None in md5sums:
+            return None
+        if b"files" in new:
+            new[b"files"] = []
+            for filedict, digest in zip(layout[b"files"], md5sums):
+                filedict = dict(filedict)
+                filedict[b"md5sum"] = digest
+                new[b"files"].append(filedict)
+        else:
+            new[b"md5sum"] = md5sums[0]
+    # Merkle torrents have a root hash instead of the pieces
+    for key in (b"root hash", b"pieces"):
+        if key in info:
+            new[key] = info[key]
+    return new
+
+
+def _segments(paths, lengths, start, end):
+    """List the file segments holding a range of a content
+
+    Positional arguments:
+    paths   -- list of the files of the content, in order
+    lengths -- list of their lengths
+    start   -- offset of the range in the content
+    end     -- offset of the end of the range (excluded)
+
+    Return: a list of (filename, offset, length) tuples
+
+    >>> _segments([b'a', b'b', b'c'], [10, 0, 10], 5, 15)
+    [(b'a', 5, 5), (b'c', 0, 5)]
+
+    """
+    segments = []
+    offset = 0
+    for filename, length in zip(paths, lengths):
+        if length and offset + length > start and offset < end:
+            first = max(start, offset)
+            last = min(end, offset + length)
+            segments.append((filename, first - offset, last - first))
+        offset += length
+        if offset >= end:
+            break
+    return segments
+
+
+def hash_shard(paths, lengths, piece_length, first, last):
+    """Hash a range of pieces of a content
+
+    Pieces are independent given their offsets: as any piece can be hashed
+    without the previous ones, a content can be hashed as separate shards.
+
+    Positional arguments:
+    paths        -- list of the files of the content, in order
+    lengths      -- list of their lengths
+    piece_length -- length of the pieces
+    first        -- index of the first piece to hash
+    last         -- index of the piece following the last one to hash
+
+    Return: the concatenated hashes of the pieces, as bytes
+
+    """
+    hasher = PieceHasher(piece_length)
+    segments = _segments(paths, lengths, first * piece_length,
+                         last * piece_length)
+    for filename, offset, length in segments:
+        with open(filename, mode='rb') as f:
+            f.seek(offset)
+            while length:
+                chunk = f.read(min(length, piece_length))
+                if not chunk:
+                    raise ValueError("%s is shorter than expected" % filename)
+                hasher.update(chunk)
+                length -= len(chunk)
+    return bytes(hasher.digest())
+
+
+class LocalWorker:
+    """Hash shards in a local worker process"""
+
+    def __init__(self):
+        self.executor = None
+
+    def __repr__(self):
+        return "LocalWorker()"
+
+    def hash(self, paths, lengths, piece_length, first, last):
+        if self.executor is None:
+            # One process per worker, so that a crash only affects one
+            self.executor = ProcessPoolExecutor(1)
+        return self.executor.submit(hash_shard, paths, lengths, piece_length,
+                                    first, last).result()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+class RemoteWorker:
+    """Hash shards in a remote worker process (cf. worker_main)
+
+    Requests and responses are bencoded dictionaries, sent over a TCP
+    connection that is kept open from shard to shard. The files must be
+    available to the remote worker with the same names, e.g. on shared
+    storage.
+
+    Positional arguments:
+    host    -- address of the worker
+    port    -- port of the worker
+
+    Optional argument:
+    timeout -- time (in seconds) to wait for the worker to connect or send
+               anything, after which the worker is considered failed and its
+               shard given to another one (defaults to 300)
+
+    """
+
+    def __init__(self, host, port, timeout=300):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.connection = None
+
+    def __repr__(self):
+        return "RemoteWorker(%r, %r)" % self.address
+
+    def hash(self, paths, lengths, piece_length, first, last):
+        if self.connection is None:
+            self.socket = socket.create_connection(self.address, self.timeout)
+            self.connection = self.socket.makefile('rwb')
+        self.connection.write(bencode({b"paths": paths, b"lengths": lengths,
+                                       b"piece length": piece_length,
+                                       b"first": first, b"last": last}))
+        self.connection.flush()
+        response = bdecode(self.connection)
+        if b"error" in response:
+            raise RuntimeError("%r: %s" % (self, response[b"error"].decode('utf-8', 'replace')))
+        return response[b"pieces"]
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.socket.close()
+            self.connection = None
+
+
+def workers(specs, timeout=300):
+    """Create workers from their specifications
+
+    Positional argument:
+    specs   -- list of specifications, either a number N of local worker
+               processes, or the HOST:PORT address of a remote worker
+
+    Optional argument:
+    timeout -- timeout of the remote workers, in seconds (cf. RemoteWorker)
+
+    >>> workers(['2', 'localhost:8643'])
+    [LocalWorker(), LocalWorker(), RemoteWorker('localhost', 8643)]
+
+    """
+    result = []
+    for spec in specs:
+        if isinstance(spec, bytes):
+            spec = spec.decode('utf-8')
+        if isinstance(spec, int) or spec.isdigit():
+            result.extend(LocalWorker() for i in range(int(spec)))
+        else:
+            host, separator, port = spec.rpartition(':')
+            if not separator or not port.isdigit():
+                raise ValueError("invalid worker specification: %s" % spec)
+            result.append(RemoteWorker(host.strip('[]'), int(port), timeout))
+    return result
+
+
+def hash_sharded(paths, lengths, piece_length, workers, pieces,
+                 shard_pieces=None, stats=None):
+    """Hash a content across several workers
+
+    The pieces are split into shards, which are given to the workers as they
+    become available. A failing worker is dropped, and its shard is given to
+    another one.
+
+    Positional arguments:
+    paths        -- list of the files of the content, in order
+    lengths      -- list of their lengths
+    piece_length -- length of the pieces
+    workers      -- list of LocalWorker or RemoteWorker
+    pieces       -- where to store the piece hashes, an object with a
+                    put(index, digest) method such as PieceStore or MerkleTree
+
+    Optional arguments:
+    shard_pieces -- number of pieces per shard (defaults to 64 mebi worth of
+                    pieces)
+    stats        -- HashStats instance to update (default to None)
+
+    """
+    if not workers:
+        raise ValueError("at least one worker is needed")
+    count = PieceStore.count(sum(lengths), piece_length)
+    if not shard_pieces:
+        shard_pieces = max(1, 64*1024*1024 // piece_length)
+    shards = Queue()
+    for first in range(0, count, shard_pieces):
+        shards.put((first, min(first + shard_pieces, count)))
+    lock = threading.Lock()
+    done = threading.Event()
+    state = {'pending': shards.qsize(), 'alive': len(workers)}
+    errors = []
+    if not state['pending']:
+        return
+    def work(worker):
+        while not done.is_set():
+            try:
+                first, last = shards.get(timeout=0.1)
+            except Empty:
+                continue
+            try:
+                digests = worker.hash(paths, lengths, piece_length, first, last)
+                if len(digests) != 20 * (last - first):
+                    raise ValueError("%r returned %d bytes for %d pieces"
+                                     % (worker, len(digests), last - first))
+            except Exception as e:
+                # Give the shard to another worker, and drop this one
+                shards.put((first, last))
+                worker.close()
+                with lock:
+                    errors.append(e)
+                    state['alive'] -= 1
+                    if not state['alive']:
+                        done.set()
+                return
+            with lock:
+                for i in range(last - first):
+                    pieces.put(first + i, digests[20*i:20*i + 20])
+                if stats:
+                    stats.bytes_read += sum(length for filename, offset, length
+                                            in _segments(paths, lengths,
+                                                         first * piece_length,
+                                                         last * piece_length))
+                    stats.piece_done(last - first)
+                state['pending'] -= 1
+                if not state['pending']:
+                    done.set()
+    threads = [threading.Thread(target=work, args=(worker,), daemon=True)
+               for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for worker in workers:
+        worker.close()
+    if state['pending']:
+        raise RuntimeError("all workers failed, last error: %s" % errors[-1]) from errors[-1]
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while self.rfile.peek(1):
+            try:
+                request = bdecode(self.rfile)
+                response = {b"pieces": hash_shard(request[b"paths"],
+                                                  request[b"lengths"],
+                                                  request[b"piece length"],
+                                                  request[b"first"],
+                                                  request[b"last"])}
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                response = {b"error": str(e).encode('utf-8')}
+            self.wfile.write(bencode(response))
+            self.wfile.flush()
+
+
+def worker_main(args=None):
+    """Run a remote worker, hashing shards for hash_sharded"""
+    parser = argparse.ArgumentParser(prog='%s worker' % path.basename(sys.argv[0]),
+                                     description='Hash shards of contents for\
+                                     remote coordinators (gentorrent\
+                                     --workers HOST:PORT). Coordinators can\
+                                     read any file this process can read.')
+    parser.add_argument('--listen', '-l', default='127.0.0.1:8643',
+                        metavar='HOST:PORT', help='address to listen on\
+                        (defaults to 127.0.0.1:8643)')
+    prog_args = parser.parse_args(args)
+    host, separator, port = prog_args.listen.rpartition(':')
+    if not separator or not port.isdigit():
+        parser.error('invalid address: %s' % prog_args.listen)
+    server = socketserver.ThreadingTCPServer((host.strip('[]'), int(port)),
+                                             WorkerHandler)
+    server.daemon_threads = True
+    print("Listening on %s:%d" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
 class Metainfo(dict):
 
     def __init__(self, filename, announce=None, nodes=None, httpseeds=None,
                  url_list=None, comment=None, piece_length=256*1024,
-                 private=False, md5sum=False, merkle=False):
+                 private=False, md5sum=False, merkle=False, stats=False,
+                 progress=None, block_size=None, readahead=4, workers=None,
+                 shard_pieces=None, storage=None, fingerprint=False):
         """Create a BitTorrent metainfo structure (cf. BEP-3).
 
         Positional arguments:
@@ -271,6 +1721,24 @@ class Metainfo(dict):
                         cf. BEP-27)
         md5sum       -- include the MD5 hash of the files (optional, defaults to False)
         merkle       -- generate a Merkle torrent (defaults to False, cf. BEP-30)
+        stats        -- gather hashing statistics in the stats attribute
+                        (defaults to False)
+        progress     -- callable, called with the HashStats each time a piece
+                        is completed (implies stats)
+        block_size   -- size of the reads (defaults to the piece length,
+                        rounded up to 4 mebi with read-ahead)
+        readahead    -- number of blocks read ahead by a background thread,
+                        or 0 to read in the hashing thread (defaults to 4)
+        workers      -- list of LocalWorker or RemoteWorker, to split the
+                        hashing across (cf. hash_sharded; incompatible with
+                        md5sum)
+        shard_pieces -- number of pieces per shard, when using workers
+        storage      -- storage the content is in, filename being then a str
+                        name in this storage (cf. storage.py; defaults to the
+                        local filesystem; incompatible with workers)
+        fingerprint  -- also compute the fingerprint of the content, from the
+                        blocks being hashed, in the fingerprint attribute
+                        (defaults to False; not computed by workers)
 
         Return: a dictionary-like structure, ready to be bencoded
 
@@ -280,6 +1748,58 @@ class Metainfo(dict):
 
         """
         super().__init__()
+        if stats or progress:
+            stats = HashStats(progress)
+            stats.start()
+        else:
+            stats = None
+        self.stats = stats
+        # List the files first, to know the total length
+        layout, paths, lengths = _layout(filename, storage)
+        hasher = _hasher(piece_length, sum(lengths), merkle, stats)
+        self.fingerprint = None
+        if workers:
+            if md5sum:
+                raise ValueError("MD5 hashes cannot be computed by workers")
+            if storage is not None:
+                raise ValueError("workers can only hash local files")
+            hash_sharded(paths, lengths, piece_length, workers, hasher.pieces,
+                         shard_pieces, stats)
+            md5sums = None
+        else:
+            consumers = []
+            if fingerprint:
+                consumers.append(_Fingerprinter(layout, lengths))
+            md5sums = _hash_files(paths, [hasher], md5sum, stats, block_size,
+                                  readahead, consumers, storage)
+            if fingerprint:
+                self.fingerprint = consumers[0].hexdigest()
+        info = _info(layout, hasher, private, merkle, md5sum and md5sums)
+        if stats:
+            stats.stop()
+        self._setup(info, announce, nodes, httpseeds, url_list, comment)
+
+    @classmethod
+    def from_info(cls, info, announce=None, nodes=None, httpseeds=None,
+                  url_list=None, comment=None):
+        """Create a BitTorrent metainfo structure around an existing info
+        dictionary, without reading nor hashing anything.
+
+        Positional argument:
+        info -- info dictionary, as built by Metainfo or bdecoded from an
+                existing metainfo file
+
+        Keyword arguments: see Metainfo
+
+        """
+        self = cls.__new__(cls)
+        dict.__init__(self)
+        self.stats = None
+        self.fingerprint = None
+        self._setup(info, announce, nodes, httpseeds, url_list, comment)
+        return self
+
+    def _setup(self, info, announce, nodes, httpseeds, url_list, comment):
         if announce:
             self[b"announce"] = announce[0][0]
             if len(announce[0]) > 1 or len(announce) > 1 :
@@ -298,94 +1818,7 @@ class Metainfo(dict):
         if comment:
             self[b"comment"] = comment
         self[b"created by"] = fullname.encode('utf-8')
-        # Now we build the info dictionnary
-        self[b"info"] = {}
-        info = self[b"info"]
-        info[b"piece length"] = piece_length
-        pieces = bytearray()
-        if private:
-            info[b"private"] = 1
-        info[b"name"] = path.basename(path.normpath(filename))
-        if path.isfile(filename):
-            info[b"length"] = path.getsize(filename)
-            if md5sum:
-                md5sum = md5()
-            with open(filename, mode='rb') as f:
-                while True:
-                    chunk = f.read(piece_length)
-                    if len(chunk) == 0:
-                        # We exactly reached the end at last iteration
-                        break
-                    pieces.extend(sha1(chunk).digest())
-                    if md5sum:
-                        md5sum.update(chunk)
-                    if len(chunk) < piece_length:
-                        # We have reached the end
-                        break
-            if md5sum:
-                info[b"md5sum"] = md5sum.hexdigest().encode('ascii')
-        elif path.isdir(filename):
-            dirname = filename
-            info[b"files"] = []
-            files = info[b"files"]
-            incomplete_chunk = bytearray()
-            for dirpath, dirnames, filenames in os.walk(dirname):
-                for filename in filenames:
-                    filedict = {}
-                    filename = path.join(dirpath, filename)
-                    filedict[b"path"] = path.relpath(filename, dirname).split(os_sep)
-                    filedict[b"length"] = path.getsize(filename)
-                    if md5sum:
-                        md5sum = md5()
-                    with open(filename, mode='rb') as f:
-                        while True:
-                            chunk = f.read(piece_length - len(incomplete_chunk))
-                            if len(chunk) == 0:
-                                # We exactly reached the end at last iteration
-                                break
-                            if len(incomplete_chunk) + len(chunk) < piece_length:
-                                # We have reached the end and got an incomplete chunk
-                                incomplete_chunk += chunk
-                                if md5sum:
-                                    md5sum.update(chunk)
-                                break
-                            # We have got a complete chunk
-                            pieces.extend(sha1(incomplete_chunk + chunk).digest())
-                            incomplete_chunk = bytearray()
-                            if md5sum:
-                                md5sum.update(chunk)
-                    if md5sum:
-                        filedict[b"md5sum"] = md5sum.hexdigest().encode('ascii')
-                    files.append(filedict)
-            if incomplete_chunk:
-                # We have an incomplete chunk left to hash
-                pieces.extend(sha1(incomplete_chunk).digest())
-        if merkle:
-            # Merkle torrent: we calculate the Merkle tree's root node
-            # to use in in place of the pieces.
-            padding = 20 * b"\0"
-            # Reduce the hashes until there is only one left
-            # (hashes are 20 bytes long).
-            while len(pieces) > 20:
-                if len(pieces) % 40:
-                    # There is an odd number of pieces: we padd it with
-                    # zeros… or recursive hashes of zeros as we are
-                    # clibing the tree, cf. BEP-30.
-                    pieces.extend(padding)
-                # Hash the hashes by two and store the result in place
-                for i in range(0, len(pieces) // 2, 20):
-                    pieces[i:i + 20] = sha1(pieces[2*i:2*i + 40]).digest()
-                # Next level…
-                # Truncate the hash list as all our new pieces are now only
-                # in its first half.
-                del pieces[len(pieces)//2:]
-                # The padding at the new level is the result of hashing two
-                # padding pieces together, cf. BEP-30.
-                padding = sha1(2 * padding).digest()
-            info[b"root hash"] = pieces
-        else:
-            # Regular torrent: we use the pieces directly
-            info[b"pieces"] = pieces
+        self[b"info"] = info
         # Shortcuts
         self.info = info
         self.__infohash = None
@@ -398,28 +1831,449 @@ class Metainfo(dict):
     @property
     def infohash(self):
         if not self.__infohash:
-            self.__infohash = sha1(bencode(self.info)).hexdigest()
+            self.__infohash = infohash(self.info)
         return self.__infohash
 
     def magnet(self):
-        params = OrderedDict()
-        params[b'dn'] = self.name
-        if self.length :
-            params[b'xl'] = ("%d" % self.length).encode('ascii')
-        params[b'xt'] = self.infohash
-        params[b'tr'] = []
-        if self.announce:
-            for tracker_list in self.announce:
-                for tracker in tracker_list:
-                    params[b'tr'].append(tracker)
-        params[b'as'] = []
-        if self.url_list:
-            for url in self.url_list:
-                params[b'as'].append(url)
-        return "magnet:?%s" % urlencode(params, doseq=True)
+        return magnet_link(self.name, self.infohash, self.length,
+                           self.announce, self.url_list)
+
+
+def ingest(source, destination, analyzer=None, piece_length=256*1024,
+           private=False, md5sum=False, merkle=False, stats=False,
+           progress=None, block_size=None, readahead=4, fingerprint=False,
+           **kwargs):
+    """Copy a file or directory, and create the BitTorrent metainfo structure
+    of the copy from the blocks being copied, so that the content is read
+    only once, and hashed from exactly the bytes that were written.
+
+    Positional arguments:
+    source      -- file or directory to copy
+    destination -- where to copy it
+
+    Optional argument:
+    analyzer    -- callable also given every block read, as (index, block),
+                   e.g. gennfo.AnalyseFlux
+
+    Keyword arguments: see Metainfo (except workers and shard_pieces)
+
+    Return: a Metainfo, describing the copy
+
+    Raise ValueError if a file would be copied onto itself.
+
+    """
+    # Fail early if the source is missing
+    os.stat(source)
+    if stats or progress:
+        stats = HashStats(progress)
+        stats.start()
+    else:
+        stats = None
+    layout, paths, lengths = _layout(source)
+    layout[b"name"] = path.basename(path.normpath(destination))
+    if path.isdir(source):
+        destinations = [path.join(destination, path.relpath(filename, source))
+                        for filename in paths]
+    else:
+        destinations = [destination]
+    # Opening a destination truncates it: it must not be its own source,
+    # under another path or as a hard link
+    for filename, copy in zip(paths, destinations):
+        if path.realpath(filename) == path.realpath(copy) or \
+           (path.exists(copy) and path.samefile(filename, copy)):
+            raise ValueError("cannot copy %s onto itself"
+                             % os.fsdecode(filename))
+    if path.isdir(source):
+        os.makedirs(destination, exist_ok=True)
+    hasher = _hasher(piece_length, sum(lengths), merkle, stats)
+    copier = _Copier(destinations, stats)
+    consumers = [copier]
+    if analyzer:
+        consumers.append(analyzer)
+    if fingerprint:
+        fingerprinter = _Fingerprinter(layout, lengths)
+        consumers.append(fingerprinter)
+    try:
+        md5sums = _hash_files(paths, [hasher], md5sum, stats, block_size,
+                              readahead, consumers)
+    finally:
+        copier.close()
+    info = _info(layout, hasher, private, merkle, md5sum and md5sums)
+    if stats:
+        stats.stop()
+    metainfo = Metainfo.from_info(info, **kwargs)
+    metainfo.stats = stats
+    if fingerprint:
+        metainfo.fingerprint = fingerprinter.hexdigest()
+    return metainfo
+
+
+def ingest_main(args=None):
+    """Copy a content and generate its metainfo file, reading it only once"""
+    locale.setlocale(locale.LC_ALL, '')
+    encoding = locale.getpreferredencoding()
+    def decode(string):
+        return string.encode(encoding)
+    parser = argparse.ArgumentParser(prog='%s ingest' % path.basename(sys.argv[0]),
+                                     description='Copy a file or directory and\
+                                     generate the BitTorrent metainfo file of\
+                                     the copy, next to it, hashing the blocks\
+                                     being copied instead of reading the copy\
+                                     again')
+    parser.add_argument('--announce', '-a', action='append', nargs='+',
+                        type=decode, metavar="URL", help='list of tracker URLs;\
+                        use several times to define backup trackers')
+    parser.add_argument('--comment', '-c', type=decode,
+                        help='optional comment added to the torrent')
+    parser.add_argument('--piece-length', '-l', type=int, metavar='N',
+                        default=256*1024, help='lenght (in bytes) of the\
+                        pieces (defaults to 256 kibi)')
+    parser.add_argument('--md5sum', action='store_true',
+                        help='include the MD5 hash of the files')
+    parser.add_argument('--private', action='store_true',
+                        help='generate a private torrent (BEP-27)')
+    parser.add_argument('--merkle', action='store_true',
+                        help='create a Merkle torrent (BEP-30)')
+    parser.add_argument('--nfo', action='store_true',
+                        help='also generate a .nfo file next to the copy,\
+                        analysing the blocks being copied when possible\
+                        (requires MediaInfo)')
+    parser.add_argument('--block-size', type=int, metavar='N',
+                        help='size (in bytes) of the copied blocks')
+    parser.add_argument('--readahead', type=int, metavar='N', default=4,
+                        help='number of blocks read ahead by a background\
+                        thread, or 0 to disable read-ahead (defaults to 4)')
+    parser.add_argument('--catalog', metavar='DB',
+                        default=os.environ.get('SEEDAVIDEO_CATALOG'),
+                        help='record the torrent in this catalog (defaults to\
+                        $SEEDAVIDEO_CATALOG, see catalog.py)')
+    parser.add_argument('--stats', action='store_true',
+                        help='print hashing statistics')
+    parser.add_argument('source', type=decode, metavar='SOURCE',
+                        help='file or directory to copy')
+    parser.add_argument('destination', type=decode, metavar='DEST',
+                        help='where to copy it; if DEST is an existing\
+                        directory, SOURCE is copied into it')
+    prog_args = parser.parse_args(args)
+    source = prog_args.source.rstrip(os_sep)
+    destination = prog_args.destination.rstrip(os_sep)
+    if path.isdir(destination):
+        destination = path.join(destination, path.basename(source))
+    analyzer = None
+    if prog_args.nfo:
+        try:
+            from gennfo import gen_nfo, AnalyseFlux
+        except (ImportError, OSError) as e:
+            parser.error('MediaInfo is not available: %s' % e)
+        if path.isfile(source):
+            analyzer = AnalyseFlux(path.getsize(source))
+    try:
+        metainfo = ingest(source, destination, analyzer,
+                          announce=prog_args.announce, comment=prog_args.comment,
+                          piece_length=prog_args.piece_length,
+                          private=prog_args.private, md5sum=prog_args.md5sum,
+                          merkle=prog_args.merkle, stats=prog_args.stats,
+                          block_size=prog_args.block_size,
+                          readahead=prog_args.readahead,
+                          fingerprint=bool(prog_args.catalog))
+    except ValueError as e:
+        parser.error(str(e))
+    infoname = destination + b'.torrent'
+    with open(infoname, 'wb') as infofile:
+        infofile.write(bencode(metainfo))
+    nfo = None
+    if prog_args.nfo:
+        nfo = gen_nfo(os.fsdecode(destination), analyse=analyzer)
+    if prog_args.catalog:
+        from catalog import record
+        record(prog_args.catalog, metainfo, destination, infoname, nfo)
+    print("Magnet link: <%s>" % metainfo.magnet())
+    if metainfo.stats:
+        print(metainfo.stats.summary())
+
+
+def build_variants(filename, variants, stats=False, progress=None,
+                   block_size=None, readahead=4, storage=None, fingerprint=False):
+    """Create several BitTorrent metainfo structures for the same content,
+    with different piece lengths, private flags or Merkle layouts, reading
+    the content only once.
+
+    Positional arguments:
+    filename -- name of the file or directory to be distributed
+    variants -- list of dictionaries of Metainfo keyword arguments, one per
+                variant (announce, nodes, httpseeds, url_list, comment,
+                piece_length, private, md5sum, merkle)
+
+    Keyword arguments:
+    stats    -- gather hashing statistics, shared by all variants, in their
+                stats attribute (defaults to False)
+    progress -- callable, called with the HashStats each time a piece is
+                completed, for any variant (implies stats)
+    block_size, readahead, storage, fingerprint -- see Metainfo
+
+    Return: a list of Metainfo, one per variant, in the same order
+
+    """
+    for variant in variants:
+        unknown = set(variant) - {'announce', 'nodes', 'httpseeds', 'url_list',
+                                  'comment', 'piece_length', 'private',
+                                  'md5sum', 'merkle'}
+        if unknown:
+            raise TypeError("unsupported variant arguments: %s"
+                            % ", ".join(sorted(unknown)))
+    if stats or progress:
+        stats = HashStats(progress)
+        stats.start()
+    else:
+        stats = None
+    layout, paths, lengths = _layout(filename, storage)
+    hashers = [_hasher(variant.get('piece_length', 256*1024), sum(lengths),
+                       variant.get('merkle'), stats)
+               for variant in variants]
+    md5sum = any(variant.get('md5sum') for variant in variants)
+    consumers = []
+    if fingerprint:
+        consumers.append(_Fingerprinter(layout, lengths))
+    md5sums = _hash_files(paths, hashers, md5sum, stats, block_size,
+                          readahead, consumers, storage)
+    metainfos = []
+    for variant, hasher in zip(variants, hashers):
+        info = _info(layout, hasher, variant.get('private'),
+                     variant.get('merkle'), variant.get('md5sum') and md5sums)
+        metainfo = Metainfo.from_info(info, announce=variant.get('announce'),
+                                      nodes=variant.get('nodes'),
+                                      httpseeds=variant.get('httpseeds'),
+                                      url_list=variant.get('url_list'),
+                                      comment=variant.get('comment'))
+        metainfos.append(metainfo)
+    if stats:
+        stats.stop()
+    for metainfo in metainfos:
+        metainfo.stats = stats
+        if fingerprint:
+            metainfo.fingerprint = consumers[0].hexdigest()
+    return metainfos
+
+
+def variants_main(args=None):
+    """Generate several metainfo files for the same content in one pass"""
+    locale.setlocale(locale.LC_ALL, '')
+    encoding = locale.getpreferredencoding()
+    def decode(string):
+        return string.encode(encoding)
+    def variant(spec):
+        variant = {}
+        for item in spec.split(','):
+            key, separator, value = item.partition('=')
+            key = key.strip().replace('-', '_')
+            if key in ('private', 'md5sum', 'merkle') and not separator:
+                variant[key] = True
+            elif key == 'piece_length' and value.isdigit():
+                variant[key] = int(value)
+            elif key == 'announce' and value:
+                variant[key] = [[decode(value)]]
+            elif key in ('comment', 'output') and value:
+                variant[key] = decode(value)
+            else:
+                raise argparse.ArgumentTypeError("invalid variant item: %r" % item)
+        return variant
+    parser = argparse.ArgumentParser(prog='%s variants' % path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description='Generate several BitTorrent\
+                                     metainfo files for the same content,\
+                                     reading it only once',
+                                     epilog="""A variant is a comma-separated list of:
+  piece-length=N, private, merkle, md5sum, announce=URL, comment=TEXT,
+  output=FILE (defaults to FILE.N.torrent for the Nth variant)
+
+Example:
+%(prog)s -a http://torrent.example.com:6969/announce \\
+         --variant piece-length=262144 \\
+         --variant piece-length=1048576,private,output=file.private.torrent \\
+         -- file""")
+    parser.add_argument('--announce', '-a', action='append', nargs='+',
+                        type=decode, metavar="URL", help='list of tracker URLs\
+                        for all variants; use several times to define backup\
+                        trackers')
+    parser.add_argument('--comment', '-c', type=decode,
+                        help='optional comment added to all variants')
+    parser.add_argument('--variant', '-V', action='append', type=variant,
+                        required=True, metavar='SPEC', dest='variants',
+                        help='variant to generate; use several times')
+    parser.add_argument('--catalog', metavar='DB',
+                        default=os.environ.get('SEEDAVIDEO_CATALOG'),
+                        help='record the torrents in this catalog (defaults to\
+                        $SEEDAVIDEO_CATALOG, see catalog.py)')
+    parser.add_argument('--stats', action='store_true',
+                        help='print hashing statistics')
+    parser.add_argument('filename', type=decode, metavar='FILE',
+                        help='file or directory to process')
+    prog_args = parser.parse_args(args)
+    filename = prog_args.filename.rstrip(os_sep)
+    variants = []
+    outputs = []
+    for i, spec in enumerate(prog_args.variants, 1):
+        spec = dict(spec)
+        outputs.append(spec.pop('output', None) or b'%s.%d.torrent' % (filename, i))
+        if prog_args.announce and 'announce' not in spec:
+            spec['announce'] = prog_args.announce
+        if prog_args.comment and 'comment' not in spec:
+            spec['comment'] = prog_args.comment
+        variants.append(spec)
+    metainfos = build_variants(prog_args.filename, variants, stats=prog_args.stats,
+                               fingerprint=bool(prog_args.catalog))
+    for output, metainfo in zip(outputs, metainfos):
+        with open(output, 'wb') as infofile:
+            infofile.write(bencode(metainfo))
+        if prog_args.catalog:
+            from catalog import record
+            record(prog_args.catalog, metainfo, filename, output)
+        print("%s: <%s>" % (output.decode(encoding, 'replace'), metainfo.magnet()))
+    if prog_args.stats:
+        print(metainfos[0].stats.summary())
+
+
+def retarget(metainfo, announce=None, comment=None, private=None,
+             source=None):
+    """Create a new BitTorrent metainfo structure from an existing one,
+    changing its trackers, comment, private flag or source tag, without
+    reading nor hashing the content again: the pieces are reused as is.
+
+    Positional argument:
+    metainfo -- existing metainfo, as bdecoded from a metainfo file
+
+    Keyword arguments (None keeps the existing value):
+    announce -- list of list of tracker announce URL (cf. Metainfo)
+    comment  -- comment, or b'' to remove it
+    private  -- True or False to set or clear the private flag (cf. BEP-27)
+    source   -- source tag, or b'' to remove it
+
+    Return: a Metainfo
+
+    Note: as the private flag and the source tag are part of the info
+    dictionary, changing them changes the infohash.
+
+    >>> info = {b"name": b"spam", b"length": 4, b"piece length": 16384, b"pieces": sha1(b"spam").digest()}
+    >>> old = bdecode(bytes(bencode(Metainfo.from_info(info, announce=[[b"http://a.example.com/announce"]]))))
+    >>> new = retarget(old, announce=[[b"http://b.example.com/announce"]], source=b"B")
+    >>> new[b"announce"], new.info[b"source"], new.info[b"pieces"] is old[b"info"][b"pieces"]
+    (b'http://b.example.com/announce', b'B', True)
+
+    """
+    info = dict(metainfo[b"info"])
+    if private is not None:
+        if private:
+            info[b"private"] = 1
+        else:
+            info.pop(b"private", None)
+    if source is not None:
+        if source:
+            info[b"source"] = source
+        else:
+            info.pop(b"source", None)
+    if announce is None:
+        announce = metainfo.get(b"announce-list")
+        if not announce and metainfo.get(b"announce"):
+            announce = [[metainfo[b"announce"]]]
+    if comment is None:
+        comment = metainfo.get(b"comment")
+    url_list = metainfo.get(b"url-list")
+    if isinstance(url_list, bytes):
+        url_list = [url_list]
+    return Metainfo.from_info(info, announce=announce,
+                              nodes=metainfo.get(b"nodes"),
+                              httpseeds=metainfo.get(b"httpseeds"),
+                              url_list=url_list, comment=comment)
+
+
+def retarget_main(args=None):
+    """Rewrite the trackers, comment, private flag or source tag of an
+    existing metainfo file"""
+    locale.setlocale(locale.LC_ALL, '')
+    encoding = locale.getpreferredencoding()
+    def decode(string):
+        return string.encode(encoding)
+    parser = argparse.ArgumentParser(prog='%s retarget' % path.basename(sys.argv[0]),
+                                     description='Change the trackers,\
+                                     comment, private flag or source tag of an\
+                                     existing BitTorrent metainfo file, without\
+                                     hashing its content again')
+    parser.add_argument('--announce', '-a', action='append', nargs='+',
+                        type=decode, metavar="URL", help='list of tracker URLs,\
+                        replacing the existing ones; use several times to\
+                        define backup trackers')
+    parser.add_argument('--comment', '-c', type=decode,
+                        help='comment, replacing the existing one (use an\
+                        empty comment to remove it)')
+    parser.add_argument('--private', action='store_true', default=None,
+                        help='make the torrent private (BEP-27)')
+    parser.add_argument('--public', action='store_false', dest='private',
+                        help='make the torrent public')
+    parser.add_argument('--source', '-s', type=decode,
+                        help='source tag, replacing the existing one (use an\
+                        empty tag to remove it)')
+    parser.add_argument('--output', '-o', type=decode, default=None,
+                        metavar='FILE', help='output file (defaults to\
+                        rewriting the input file in place)')
+    parser.add_argument('filename', type=decode, metavar='FILE',
+                        help='metainfo file to process')
+    prog_args = parser.parse_args(args)
+    with open(prog_args.filename, 'rb') as infofile:
+        metainfo = bdecode(infofile.read())
+    metainfo = retarget(metainfo, announce=prog_args.announce,
+                        comment=prog_args.comment, private=prog_args.private,
+                        source=prog_args.source)
+    with open(prog_args.output or prog_args.filename, 'wb') as infofile:
+        infofile.write(bencode(metainfo))
+    print("Magnet link: <%s>" % metainfo.magnet())
+
+
+def magnets_main(args=None):
+    """Print the magnet links of existing metainfo files"""
+    parser = argparse.ArgumentParser(prog='%s magnets' % path.basename(sys.argv[0]),
+                                     description='Print the magnet links of\
+                                     existing BitTorrent metainfo files, one\
+                                     "FILE<tab>LINK" line per file')
+    parser.add_argument('filenames', nargs='*', metavar='FILE',
+                        help='metainfo files to process; with no FILE, or\
+                        when FILE is -, read file names from standard input,\
+                        one per line')
+    prog_args = parser.parse_args(args)
+    def filenames():
+        for filename in prog_args.filenames or ['-']:
+            if filename == '-':
+                for line in sys.stdin:
+                    line = line.rstrip('\n')
+                    if line:
+                        yield line
+            else:
+                yield filename
+    status = 0
+    for filename in filenames():
+        try:
+            with open(filename, 'rb') as f:
+                link = torrent_magnet(f.read())
+        except (OSError, ValueError) as e:
+            print("%s: %s" % (filename, e), file=sys.stderr)
+            status = 1
+            continue
+        print("%s\t%s" % (filename, link))
+    return status
+
+
+# Commands other than torrent creation, given as first argument
+commands = {
+    'ingest': ingest_main,
+    'magnets': magnets_main,
+    'retarget': retarget_main,
+    'variants': variants_main,
+    'worker': worker_main,
+}
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        return commands[sys.argv[1]](sys.argv[2:])
     locale.setlocale(locale.LC_ALL, '')
     encoding = locale.getpreferredencoding()
     def decode(string):
@@ -434,7 +2288,14 @@ def main():
 For a trackerless (DHT) torrent:
 %(prog)s --nodes foo.example.com:51413 \\
                  192.2.0.42:51413 \\
-                 [2001:db8::42]:51413 -- file""")
+                 [2001:db8::42]:51413 -- file
+
+Other commands:
+%(prog)s ingest [--nfo] SOURCE DEST
+%(prog)s magnets FILE.torrent …
+%(prog)s retarget --announce URL [--source TAG] FILE.torrent
+%(prog)s variants --variant SPEC --variant SPEC … -- FILE
+%(prog)s worker [--listen HOST:PORT]""")
     parser.add_argument('--announce', '-a', action='append', nargs='+',
                         type=decode, metavar="URL", help='list of tracker URLs;\
                         use several times to define backup trackers')
@@ -462,6 +2323,48 @@ For a trackerless (DHT) torrent:
                         help='create a Merkle torrent (BEP-30): this allows to\
                         produces a very light file but requires more computing\
                         and is not widely supported by clients')
+    parser.add_argument('--block-size', type=int, metavar='N',
+                        help='size (in bytes) of the reads (defaults to the\
+                        piece length, rounded up to 4 mebi with read-ahead)')
+    parser.add_argument('--readahead', type=int, metavar='N', default=4,
+                        help='number of blocks read ahead by a background\
+                        thread, or 0 to disable read-ahead (defaults to 4)')
+    parser.add_argument('--catalog', metavar='DB',
+                        default=os.environ.get('SEEDAVIDEO_CATALOG'),
+                        help='record the torrent in this catalog (defaults to\
+                        $SEEDAVIDEO_CATALOG, see catalog.py)')
+    parser.add_argument('--reuse', action='store_true',
+                        help='if the catalog knows a torrent of the same\
+                        content, recognized by a quick fingerprint reading a\
+                        few mebibytes per file, reuse its pieces instead of\
+                        hashing the content')
+    parser.add_argument('--verify', action='store_true',
+                        help='with --reuse, hash the content anyway and check\
+                        the reused pieces')
+    parser.add_argument('--storage', metavar='URL|DIR',
+                        help='read FILE from this storage, e.g. an HTTP server\
+                        supporting range requests, instead of the local\
+                        filesystem; the output files are written in the\
+                        current directory (see storage.py)')
+    parser.add_argument('--connections', type=int, metavar='N', default=4,
+                        help='number of concurrent range requests to an HTTP\
+                        storage (defaults to 4)')
+    parser.add_argument('--nfo', action='store_true',
+                        help='also generate a .nfo file next to the torrent\
+                        (requires MediaInfo)')
+    parser.add_argument('--workers', '-w', nargs='+', metavar='N|HOST:PORT',
+                        help='split the hashing across N local processes\
+                        and/or remote workers (see the worker command)')
+    parser.add_argument('--worker-timeout', type=float, metavar='SECONDS',
+                        default=300, help='time to wait for a remote worker,\
+                        after which its shard is given to another worker\
+                        (defaults to 300)')
+    parser.add_argument('--shard-pieces', type=int, metavar='N',
+                        help='number of pieces per shard given to a worker\
+                        (defaults to 64 mebi worth of pieces)')
+    parser.add_argument('--stats', action='store_true',
+                        help='print hashing statistics: bytes read, time spent\
+                        in I/O and in hashing, per-file timings')
     parser.add_argument('--output', '-o', type=decode, default=None,
                         metavar='FILE', help='output file (defaults to the input\
                         file with .torrent appended)')
@@ -498,16 +2401,89 @@ For a trackerless (DHT) torrent:
         func_args['private'] = True
     if prog_args.merkle:
         func_args['merkle'] = True
-    filename = prog_args.filename.rstrip(os_sep)
+    if prog_args.stats:
+        func_args['stats'] = True
+    if prog_args.block_size:
+        func_args['block_size'] = prog_args.block_size
+    func_args['readahead'] = prog_args.readahead
+    if prog_args.catalog:
+        # Recorded with the torrent, computed from the blocks being hashed
+        func_args['fingerprint'] = True
+    if prog_args.workers:
+        try:
+            func_args['workers'] = workers(prog_args.workers,
+                                           prog_args.worker_timeout)
+        except ValueError as e:
+            parser.error(str(e))
+        if prog_args.md5sum:
+            parser.error('--md5sum cannot be used with --workers')
+    if prog_args.shard_pieces:
+        func_args['shard_pieces'] = prog_args.shard_pieces
+    if prog_args.reuse and not prog_args.catalog:
+        parser.error('--reuse requires a catalog')
+    storage = None
+    if prog_args.storage:
+        if prog_args.workers or prog_args.reuse:
+            parser.error('--workers and --reuse cannot be used with --storage')
+        from storage import open_storage
+        try:
+            storage = open_storage(prog_args.storage, prog_args.connections)
+        except ValueError as e:
+            parser.error(str(e))
+        func_args['storage'] = storage
+    if storage:
+        # Name in the storage; the output goes to the current directory
+        filename = os.fsdecode(prog_args.filename).rstrip('/')
+        outname = path.basename(prog_args.filename.rstrip(b'/'))
+    else:
+        filename = prog_args.filename.rstrip(os_sep)
+        outname = filename
     if prog_args.output:
         infoname = prog_args.output
     else:
-        infoname = filename + b'.torrent'
+        infoname = outname + b'.torrent'
+    metainfo = None
+    if prog_args.reuse:
+        from catalog import Catalog
+        catalog = Catalog(prog_args.catalog)
+        content_fingerprint = fingerprint(filename)
+        try:
+            info = catalog.reuse(filename, prog_args.piece_length or 256*1024,
+                                 prog_args.private, prog_args.merkle,
+                                 prog_args.md5sum, content_fingerprint)
+        finally:
+            catalog.close()
+        if info:
+            metainfo = Metainfo.from_info(info, **{key: func_args[key] for key in
+                                                   ('announce', 'nodes', 'httpseeds',
+                                                    'url_list', 'comment')
+                                                   if key in func_args})
+            metainfo.fingerprint = content_fingerprint
+            print("Pieces reused from a known torrent of the same content")
+    if metainfo is None or prog_args.verify:
+        hashed = Metainfo(filename if storage else prog_args.filename, **func_args)
+        if metainfo is not None and hashed.infohash != metainfo.infohash:
+            print("The reused pieces do not match the content: using the new ones",
+                  file=sys.stderr)
+        metainfo = hashed
     with open(infoname, 'wb') as infofile:
-        metainfo = Metainfo(prog_args.filename, **func_args)
         infofile.write(bencode(metainfo))
+    nfo = None
+    if prog_args.nfo:
+        from gennfo import gen_nfo
+        nfo = gen_nfo(filename if storage else os.fsdecode(filename),
+                      stockage=storage, sortie=os.fsdecode(outname) + '.nfo')
+    if storage:
+        storage.close()
+    if prog_args.catalog:
+        from catalog import record
+        # Remote content is not recorded by path, nor fingerprinted
+        record(prog_args.catalog, metainfo, None if storage else filename,
+               infoname, nfo)
     print("Magnet link: <%s>" % metainfo.magnet())
+    if metainfo.stats:
+        print(metainfo.stats.summary())
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -5,6 +5,7 @@
 import os
 from gennfo import *
 from gentorrent import *
+from catalog import CATALOG_ENV, record
 from tkinter import *
 from tkinter import filedialog
 
@@ -39,14 +40,33 @@ class Interface(Frame):
 
 		self.announce = [[str.encode(self.announce.get())]]
 
+		torrent = None
+		if os.path.isfile(self.infoname) and os.path.getmtime(self.infoname) >= os.path.getmtime(self.filename):
+			# Un .torrent plus récent que la vidéo existe déjà : on change
+			# seulement son announce, sans relire toute la vidéo
+			try:
+				with open(self.infoname, "rb") as infofile:
+					ancien = bdecode(infofile.read())
+				if ancien[b"info"].get(b"length") == os.path.getsize(self.filename):
+					torrent = retarget(ancien, announce=self.announce, private=True)
+			except (ValueError, KeyError, TypeError, AttributeError):
+				# .torrent vide ou abîmé, par exemple par une génération
+				# interrompue : on le refait entièrement
+				torrent = None
+		if torrent is None:
+			torrent = Metainfo(self.filename, announce=self.announce, private=True, fingerprint=bool(os.environ.get(CATALOG_ENV)))
+
 		print("Enregistrement des métadonnées dans le .torrent")
 		with open(self.infoname, "wb") as infofile:
-			torrent = Metainfo(self.filename, announce=self.announce, private=True)
 			infofile.write(bencode(torrent))
 		print("Fait")
 
 		# Generation du NFO
-		gen_nfo(self.fichier)
+		nfo = gen_nfo(self.fichier)
+
+		# Enregistrement dans le catalogue, s'il y en a un
+		if os.environ.get(CATALOG_ENV):
+			record(os.environ[CATALOG_ENV], torrent, self.filename, self.infoname, nfo)
 
 		print("\nGénération des fichiers .nfo et .torrent terminés.")
 		print("Logiciel écrit par FreePostPas.")
@@ -0,0 +1,469 @@
+#! /usr/bin/python3
+
+# Storage backends, to generate torrents and NFOs from content that is not
+# on a local filesystem, without copying it locally first
+#
+# A storage gives access to named files and directories, through three
+# operations: listing the files of a directory, getting the size of a file
+# or directory (stat) and reading a range of bytes of a file. Names are
+# relative to the root of the storage, with "/" as separator.
+#
+# LocalStorage reads from a local directory. HTTPStorage reads from an HTTP
+# server supporting range requests, e.g. an object store, through a pool of
+# keep-alive connections, fetching several ranges concurrently; directories
+# are listed from their HTML index pages.
+#
+# File order: the pieces of a directory torrent depend on the order of its
+# files. LocalStorage, like a local path given to gentorrent, lists files in
+# os.walk order, which depends on the filesystem; HTTPStorage lists them in
+# the same top-down way, but sorted by name. A directory hashed over HTTP may
+# then get another infohash than its local copy, and be recorded twice in a
+# catalog; single files always get the same one.
+#
+# RangeRequestHandler is a local stand-in for an HTTP server supporting
+# range requests, serving a directory:
+#   ./storage.py serve /srv/media --port 8000
+#   ./gentorrent.py --storage http://127.0.0.1:8000/ -a URL -- video.mkv
+#
+# Typical usage:
+#   storage = open_storage('https://media.example.com/videos/')
+#   metainfo = Metainfo('video.mkv', storage=storage, announce=…)
+#   gen_nfo('video.mkv', stockage=storage, sortie='video.mkv.nfo')
+
+
+
+import argparse
+import os
+import re
+import sys
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, LifoQueue
+from time import perf_counter
+from urllib.parse import quote, unquote, urlsplit
+
+from gentorrent import ReadAhead
+
+# Size and kind of a file or directory; the size of a directory is the total
+# size of its files
+Stat = namedtuple('Stat', ['size', 'isdir'])
+
+
+class LocalStorage:
+    """Files of a local directory
+
+    Positional argument:
+    root -- directory the names are relative to
+
+    Optional argument:
+    depth -- number of blocks read ahead by a background thread (defaults to
+             4, cf. gentorrent.ReadAhead)
+
+    Listing order is the order of os.walk, as for a local path given to
+    Metainfo, so that both give the same torrent.
+
+    """
+
+    def __init__(self, root, depth=4):
+        self.root = root
+        self.depth = depth
+
+    def __repr__(self):
+        return 'LocalStorage(%r)' % self.root
+
+    def path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def list(self, name):
+        """List the files of a directory, recursively
+
+        Return: a list of (relative name, size)
+
+        """
+        dirname = self.path(name)
+        files = []
+        for dirpath, dirnames, filenames in os.walk(dirname):
+            for filename in filenames:
+                filename = os.path.join(dirpath, filename)
+                files.append(('/'.join(os.path.relpath(filename, dirname).split(os.sep)),
+                              os.path.getsize(filename)))
+        return files
+
+    def stat(self, name):
+        filename = self.path(name)
+        if os.path.isdir(filename):
+            return Stat(sum(size for relname, size in self.list(name)), True)
+        return Stat(os.path.getsize(filename), False)
+
+    def read(self, name, offset, length):
+        with open(self.path(name), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def blocks(self, names, block_size, stats=None):
+        """Read files by blocks, in order
+
+        Return: an iterable of (index, block) tuples, as gentorrent.ReadAhead
+
+        """
+        return ReadAhead([self.path(name) for name in names], block_size,
+                         self.depth, stats)
+
+    def close(self):
+        pass
+
+
+class _IndexParser(HTMLParser):
+    """Collect the links of an HTML directory index"""
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.links.append(href)
+
+
+class HTTPStorage:
+    """Files served over HTTP, read with range requests
+
+    Positional argument:
+    url         -- base URL the names are relative to
+
+    Optional arguments:
+    connections -- number of pooled keep-alive connections, which is also
+                   the number of ranges fetched concurrently (defaults to 4)
+    timeout     -- timeout of the connections, in seconds (defaults to 60)
+    retries     -- number of retries of a failed request, on a new
+                   connection (defaults to 2)
+
+    The server must support range requests; directories are listed from
+    their HTML index pages (links to subdirectories end with "/"), as served
+    by common web servers and by RangeRequestHandler. Files are listed top
+    down, as os.walk does, sorted by name: directory torrents may differ from
+    those of a local copy, whose order depends on the filesystem.
+
+    The storage can be shared between threads.
+
+    """
+
+    def __init__(self, url, connections=4, timeout=60, retries=2):
+        if not url.endswith('/'):
+            url += '/'
+        self.url = url
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError("not an HTTP URL: %s" % url)
+        self.connection_class = HTTPSConnection if parts.scheme == 'https' else HTTPConnection
+        self.host = parts.netloc
+        self.base = parts.path
+        self.connections = connections
+        self.timeout = timeout
+        self.retries = retries
+        # Idle connections, most recently used first
+        self.pool = LifoQueue()
+        # File sizes, from listings and stats
+        self.sizes = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return 'HTTPStorage(%r)' % self.url
+
+    def _path(self, name):
+        return self.base + quote(name)
+
+    def request(self, method, name, headers=None):
+        """Send a request on a pooled connection
+
+        Return: (status, headers, body)
+
+        Raise OSError if a range is requested and the server answers with the
+        whole file.
+
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                connection = self.pool.get_nowait()
+            except Empty:
+                connection = self.connection_class(self.host, timeout=self.timeout)
+            headers = headers or {}
+            try:
+                connection.request(method, self._path(name), headers=headers)
+                response = connection.getresponse()
+                if 'Range' in headers and response.status == 200:
+                    # The whole file is coming: do not download it
+                    body = None
+                else:
+                    body = response.read()
+            except (OSError, HTTPException):
+                # Stale keep-alive connection, or network error
+                connection.close()
+                if attempt == self.retries:
+                    raise
+                continue
+            if body is None:
+                connection.close()
+                raise OSError("%s: the server does not support range requests"
+                              % (self.url + name))
+            if response.will_close:
+                connection.close()
+            else:
+                self.pool.put(connection)
+            return response.status, response.headers, body
+
+    def list(self, name):
+        """List the files of a directory, recursively, from its index pages
+
+        Return: a list of (relative name, size)
+
+        """
+        dirname = name.rstrip('/') + '/' if name else ''
+        files = []
+        # Directories to list, next one last
+        subdirs = ['']
+        while subdirs:
+            subdir = subdirs.pop()
+            status, headers, body = self.request('GET', dirname + subdir)
+            if status != 200:
+                raise OSError("%s: HTTP %d" % (self.url + dirname + subdir, status))
+            parser = _IndexParser()
+            parser.feed(body.decode(headers.get_content_charset() or 'utf-8',
+                                    'replace'))
+            names = []
+            found = []
+            for href in parser.links:
+                parts = urlsplit(href)
+                if parts.scheme or parts.netloc or parts.query or \
+                   parts.path.startswith(('/', '.')) or not parts.path:
+                    # Sorting links, parent directory, other sites…
+                    continue
+                relname = subdir + unquote(parts.path)
+                if relname.endswith('/'):
+                    found.append(relname)
+                else:
+                    names.append(relname)
+            names.sort()
+            # Top down, as os.walk: the files of a directory, then the ones of
+            # each subdirectory, in order
+            subdirs.extend(sorted(found, reverse=True))
+            # The sizes are not in the index: ask for them concurrently
+            with ThreadPoolExecutor(self.connections) as executor:
+                sizes = list(executor.map(lambda relname: self.stat(dirname + relname).size,
+                                          names))
+            files.extend(zip(names, sizes))
+        return files
+
+    def stat(self, name):
+        if not name or name.endswith('/'):
+            return Stat(sum(size for relname, size in self.list(name)), True)
+        with self.lock:
+            if name in self.sizes:
+                return Stat(self.sizes[name], False)
+        status, headers, body = self.request('HEAD', name)
+        if status in (301, 302, 307, 308) and \
+           headers.get('Location', '').endswith('/'):
+            return self.stat(name + '/')
+        if status != 200:
+            raise OSError("%s: HTTP %d" % (self.url + name, status))
+        size = int(headers['Content-Length'])
+        with self.lock:
+            self.sizes[name] = size
+        return Stat(size, False)
+
+    def read(self, name, offset, length):
+        if length <= 0:
+            return b''
+        status, headers, body = self.request('GET', name, {
+            'Range': 'bytes=%d-%d' % (offset, offset + length - 1)})
+        if status == 206:
+            return body
+        if status == 416:
+            return b''
+        raise OSError("%s: HTTP %d" % (self.url + name, status))
+
+    def blocks(self, names, block_size, stats=None):
+        """Read files by blocks, in order, fetching up to `connections`
+        blocks concurrently
+
+        Return: an iterable of (index, block) tuples, as gentorrent.ReadAhead;
+        stats I/O time is the time spent waiting for blocks
+
+        """
+        def ranges():
+            for index, name in enumerate(names):
+                size = self.stat(name).size
+                for offset in range(0, size, block_size):
+                    yield index, name, offset, min(block_size, size - offset)
+                yield index, name, None, None
+        def fetch(name, offset, length):
+            block = self.read(name, offset, length)
+            if len(block) != length:
+                raise OSError("%s: short read at offset %d" % (self.url + name, offset))
+            return block
+        with ThreadPoolExecutor(self.connections) as executor:
+            # Blocks being fetched, in order
+            pending = deque()
+            todo = ranges()
+            while True:
+                while len(pending) < 2 * self.connections:
+                    item = next(todo, None)
+                    if item is None:
+                        break
+                    index, name, offset, length = item
+                    if offset is None:
+                        pending.append((index, None))
+                    else:
+                        pending.append((index, executor.submit(fetch, name, offset, length)))
+                if not pending:
+                    break
+                index, future = pending.popleft()
+                if future is None:
+                    yield index, None
+                    continue
+                if stats:
+                    start = perf_counter()
+                    block = future.result()
+                    stats.io_time += perf_counter() - start
+                    stats.bytes_read += len(block)
+                else:
+                    block = future.result()
+                yield index, block
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except Empty:
+                break
+
+
+def open_storage(location, connections=4):
+    """Open a storage from an HTTP(S) URL or a local directory"""
+    if re.match(r'^https?://', location):
+        return HTTPStorage(location, connections)
+    return LocalStorage(location)
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """SimpleHTTPRequestHandler serving single byte ranges, over keep-alive
+    connections: a local stand-in for HTTPStorage"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def send_head(self):
+        self.range = None
+        match = re.match(r'^bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        filename = self.translate_path(self.path)
+        if not match or os.path.isdir(filename):
+            return super().send_head()
+        try:
+            f = open(filename, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+        size = os.fstat(f.fileno()).st_size
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+        if start >= size or end < start:
+            f.close()
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % size)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(filename))
+        self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, size))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        f.seek(start)
+        self.range = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        if self.range is None:
+            return super().copyfile(source, outputfile)
+        remaining = self.range
+        while remaining:
+            data = source.read(min(remaining, 1024*1024))
+            if not data:
+                break
+            outputfile.write(data)
+            remaining -= len(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(directory, host='127.0.0.1', port=0, verbose=False):
+    """Create a server for a directory, with RangeRequestHandler; port 0
+    picks a free port
+
+    Return: the ThreadingHTTPServer, to be run with serve_forever()
+
+    """
+    handler = lambda *args: RangeRequestHandler(*args, directory=directory)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Storage backends for gentorrent and gennfo')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser_serve = subparsers.add_parser('serve', help='serve a directory\
+                                         over HTTP with range requests, as a\
+                                         local stand-in for a remote storage')
+    parser_serve.add_argument('directory', metavar='DIR', help='directory to serve')
+    parser_serve.add_argument('--host', default='127.0.0.1',
+                              help='address to listen on (defaults to 127.0.0.1)')
+    parser_serve.add_argument('--port', '-p', type=int, default=8000,
+                              help='port to listen on (defaults to 8000)')
+    parser_ls = subparsers.add_parser('ls', help='list the files of a storage')
+    parser_ls.add_argument('location', metavar='URL|DIR', help='storage')
+    parser_ls.add_argument('name', nargs='?', default='', metavar='NAME',
+                           help='directory to list (defaults to the root)')
+    parser_cat = subparsers.add_parser('cat', help='print a range of a file')
+    parser_cat.add_argument('location', metavar='URL|DIR', help='storage')
+    parser_cat.add_argument('name', metavar='NAME', help='file to read')
+    parser_cat.add_argument('--offset', type=int, default=0, metavar='N',
+                            help='first byte to read (defaults to 0)')
+    parser_cat.add_argument('--length', type=int, metavar='N',
+                            help='number of bytes to read (defaults to the\
+                            rest of the file)')
+    args = parser.parse_args()
+    if args.command == 'serve':
+        server = serve(args.directory, args.host, args.port, verbose=True)
+        print("Serving %s on http://%s:%d/" % ((args.directory,) + server.server_address[:2]))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        return 0
+    storage = open_storage(args.location)
+    try:
+        if args.command == 'ls':
+            for name, size in storage.list(args.name):
+                print("%d\t%s" % (size, name))
+        else:
+            length = args.length
+            if length is None:
+                length = storage.stat(args.name).size - args.offset
+            sys.stdout.buffer.write(storage.read(args.name, args.offset, length))
+    finally:
+        storage.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
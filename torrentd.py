@@ -0,0 +1,369 @@
+#! /usr/bin/python3
+
+# A local torrent and NFO generation service
+#
+# Jobs are submitted as JSON over HTTP, queued by priority and run by a fixed
+# pool of worker threads, in a single long-running process: MediaInfo is
+# loaded once, and the info dictionaries of recently hashed content are
+# kept in memory, so that generating a torrent for the same content again,
+# e.g. for another tracker, does not read it again.
+#
+# Endpoints:
+#   POST /jobs             submit a job, returns {"id": …}
+#   GET  /jobs             list the jobs and their status
+#   GET  /jobs/<id>        status of a job
+#   GET  /jobs/<id>/result result of a finished job
+#
+# Job parameters (JSON object):
+#   path          file or directory to process (required)
+#   announce      tracker URL, list of tracker URLs (one tier each), or list
+#                 of list of tracker URLs (cf. BEP-12)
+#   private       generate a private torrent (default to false)
+#   piece_length  length of the pieces, a power of two of at least 16 kibi
+#                 (default to 256 kibi)
+#   comment       optional comment
+#   output        metainfo file to write (default to path + ".torrent")
+#   nfo           also generate a .nfo file next to path (default to false)
+#   priority      lower values run first (default to 0)
+#
+# Finished jobs are forgotten after a while (--job-ttl), or when too many
+# of them are kept (--keep-jobs), the oldest first.
+
+
+
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from queue import Full, PriorityQueue
+from time import time
+
+from catalog import CATALOG_ENV, Catalog
+from gentorrent import Metainfo, bencode, fullname
+try:
+    from gennfo import gen_nfo, MediaInfo
+except (ImportError, OSError):
+    # MediaInfo is not available: jobs asking for a .nfo file will fail
+    gen_nfo = None
+
+
+def announce_list(announce):
+    """Check the announce parameter of a job, and return it as a list of
+    list of URLs, or None
+
+    >>> announce_list("http://a/announce")
+    [['http://a/announce']]
+    >>> announce_list(["http://a/announce", "http://b/announce"])
+    [['http://a/announce'], ['http://b/announce']]
+    >>> announce_list([["http://a/announce", "http://b/announce"]])
+    [['http://a/announce', 'http://b/announce']]
+    >>> announce_list([1])
+    Traceback (most recent call last):
+    ...
+    ValueError: announce must be a URL, a list of URLs or a list of list of URLs
+
+    """
+    if not announce:
+        return None
+    if isinstance(announce, str):
+        return [[announce]]
+    if isinstance(announce, list):
+        if all(isinstance(url, str) for url in announce):
+            # Flat list: each URL is a tier of its own
+            return [[url] for url in announce]
+        if all(isinstance(tier, list) and tier and
+               all(isinstance(url, str) for url in tier) for tier in announce):
+            return announce
+    raise ValueError("announce must be a URL, a list of URLs or a list of list of URLs")
+
+
+class Job:
+
+    def __init__(self, params):
+        # Set when the job is queued
+        self.id = None
+        self.params = params
+        priority = params.get('priority', 0)
+        if isinstance(priority, bool) or not isinstance(priority, (int, str)):
+            raise ValueError("priority must be an integer")
+        try:
+            self.priority = int(priority)
+        except ValueError:
+            raise ValueError("priority must be an integer")
+        announce_list(params.get('announce'))
+        piece_length = params.get('piece_length', 256*1024)
+        if isinstance(piece_length, bool) or not isinstance(piece_length, int) \
+           or piece_length < 16*1024 or piece_length & (piece_length - 1):
+            raise ValueError("piece_length must be a power of two, of at least 16384")
+        self.piece_length = piece_length
+        for name in ('private', 'nfo'):
+            if not isinstance(params.get(name, False), bool):
+                raise ValueError("%s must be true or false" % name)
+        self.private = params.get('private', False)
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.submitted = time()
+        self.started = None
+        self.finished = None
+
+    def describe(self):
+        return {'id': self.id, 'status': self.status,
+                'priority': self.priority, 'path': self.params['path'],
+                'submitted': self.submitted, 'started': self.started,
+                'finished': self.finished, 'error': self.error}
+
+
+class Service:
+    """Queue of torrent generation jobs, run by a fixed pool of workers
+
+    Keyword arguments:
+    workers    -- number of worker threads (defaults to 2)
+    queue_size -- maximum number of queued jobs, beyond which submissions are
+                  refused (defaults to 100)
+    cache_size -- number of info dictionaries kept in memory (defaults to 64)
+    catalog    -- Catalog in which generated torrents are recorded (defaults
+                  to None)
+    keep_jobs  -- maximum number of finished jobs kept, with their result
+                  (defaults to 1000)
+    job_ttl    -- time (in seconds) finished jobs are kept (defaults to 3600)
+
+    """
+
+    def __init__(self, workers=2, queue_size=100, cache_size=64, catalog=None,
+                 keep_jobs=1000, job_ttl=3600):
+        self.queue = PriorityQueue(queue_size)
+        self.jobs = OrderedDict()
+        # Ids of the finished jobs, oldest first
+        self.finished = OrderedDict()
+        self.keep_jobs = keep_jobs
+        self.job_ttl = job_ttl
+        self.lock = threading.Lock()
+        self.last_id = 0
+        # Info dictionaries of recently hashed content, by content key
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.catalog = catalog
+        self.local = threading.local()
+        self.workers = [threading.Thread(target=self.work, daemon=True)
+                        for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, params):
+        """Queue a job and return it
+
+        Raise ValueError on invalid parameters, queue.Full when the queue is
+        full.
+
+        """
+        if not isinstance(params, dict) or not isinstance(params.get('path'), str) \
+           or not params['path']:
+            raise ValueError("a path is required")
+        job = Job(params)
+        with self.lock:
+            self.expire()
+            job.id = self.last_id + 1
+            # The job id keeps jobs of the same priority in FIFO order
+            self.queue.put_nowait((job.priority, job.id, job))
+            self.last_id = job.id
+            self.jobs[job.id] = job
+        return job
+
+    def get(self, id):
+        with self.lock:
+            return self.jobs.get(id)
+
+    def list(self):
+        with self.lock:
+            self.expire()
+            return [job.describe() for job in self.jobs.values()]
+
+    def expire(self):
+        """Forget the finished jobs that are too old or too many; the lock
+        must be held"""
+        deadline = time() - self.job_ttl
+        while self.finished:
+            id, finished = next(iter(self.finished.items()))
+            if len(self.finished) <= self.keep_jobs and finished >= deadline:
+                break
+            del self.finished[id]
+            del self.jobs[id]
+
+    def work(self):
+        while True:
+            priority, id, job = self.queue.get()
+            job.status = 'running'
+            job.started = time()
+            try:
+                job.result = self.run(job)
+                job.status = 'done'
+            except Exception as e:
+                job.error = str(e)
+                job.status = 'failed'
+            with self.lock:
+                job.finished = time()
+                self.finished[job.id] = job.finished
+                self.expire()
+            self.queue.task_done()
+
+    def content_key(self, filename, piece_length, private):
+        """Identify the content to hash, from file sizes and modification
+        times: hashing it again would give the same info dictionary"""
+        if path.isdir(filename):
+            files = []
+            for dirpath, dirnames, filenames in os.walk(filename):
+                for name in filenames:
+                    st = os.stat(path.join(dirpath, name))
+                    files.append((dirpath, name, st.st_size, st.st_mtime_ns))
+            files = tuple(files)
+        else:
+            st = os.stat(filename)
+            files = (st.st_size, st.st_mtime_ns)
+        return (filename, files, piece_length, private)
+
+    def info(self, filename, piece_length, private):
+        """Return the info dictionary of a content and its fingerprint (if
+        the service has a catalog), from cache if possible"""
+        key = self.content_key(filename, piece_length, private)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        metainfo = Metainfo(filename, piece_length=piece_length,
+                            private=private,
+                            fingerprint=self.catalog is not None)
+        with self.lock:
+            self.cache[key] = metainfo.info, metainfo.fingerprint
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return metainfo.info, metainfo.fingerprint
+
+    def run(self, job):
+        params = job.params
+        filename = os.fsencode(params['path'])
+        announce = announce_list(params.get('announce'))
+        if announce:
+            announce = [[url.encode('utf-8') for url in tier]
+                        for tier in announce]
+        comment = params.get('comment')
+        if comment:
+            comment = comment.encode('utf-8')
+        if not path.exists(filename):
+            raise ValueError("no such file or directory: %s" % params['path'])
+        if params.get('nfo') and gen_nfo is None:
+            raise RuntimeError("MediaInfo is not available")
+        info, fingerprint = self.info(filename, job.piece_length, job.private)
+        metainfo = Metainfo.from_info(info, announce=announce, comment=comment)
+        output = params.get('output') or params['path'] + '.torrent'
+        with open(output, 'wb') as infofile:
+            infofile.write(bencode(metainfo))
+        result = {'torrent': output, 'infohash': metainfo.infohash,
+                  'magnet': metainfo.magnet()}
+        nfo = None
+        if params.get('nfo'):
+            # One MediaInfo instance per worker, reused from job to job
+            if not hasattr(self.local, 'mediainfo'):
+                self.local.mediainfo = MediaInfo()
+            nfo = gen_nfo(params['path'], self.local.mediainfo)
+            result['nfo'] = params['path'] + '.nfo'
+        if self.catalog:
+            self.catalog.add(metainfo, path.abspath(params['path']),
+                             path.abspath(output), nfo, fingerprint)
+        return result
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    server_version = fullname.replace(' ', '/')
+
+    def reply(self, code, data, headers=()):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def job(self, id):
+        try:
+            return self.server.service.get(int(id))
+        except ValueError:
+            return None
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            return self.reply(200, self.server.service.list())
+        if len(parts) < 2 or len(parts) > 3 or parts[0] != 'jobs':
+            return self.reply(404, {'error': 'not found'})
+        job = self.job(parts[1])
+        if job is None:
+            return self.reply(404, {'error': 'no such job'})
+        if len(parts) == 2:
+            return self.reply(200, job.describe())
+        if parts[2] != 'result':
+            return self.reply(404, {'error': 'not found'})
+        if job.status == 'failed':
+            return self.reply(500, {'error': job.error})
+        if job.status != 'done':
+            return self.reply(409, {'error': 'job is %s' % job.status})
+        return self.reply(200, job.result)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self.reply(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = self.server.service.submit(json.loads(self.rfile.read(length)))
+        except ValueError as e:
+            return self.reply(400, {'error': str(e)})
+        except Full:
+            return self.reply(503, {'error': 'too many queued jobs'},
+                              [('Retry-After', '5')])
+        self.reply(202, {'id': job.id}, [('Location', '/jobs/%d' % job.id)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local torrent and NFO generation service')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (defaults to 127.0.0.1)')
+    parser.add_argument('--port', '-p', type=int, default=8642,
+                        help='port to listen on (defaults to 8642)')
+    parser.add_argument('--workers', '-w', type=int, default=2, metavar='N',
+                        help='number of jobs run concurrently (defaults to 2)')
+    parser.add_argument('--queue-size', type=int, default=100, metavar='N',
+                        help='maximum number of queued jobs, beyond which\
+                        submissions are refused (defaults to 100)')
+    parser.add_argument('--cache-size', type=int, default=64, metavar='N',
+                        help='number of hashed contents kept in memory\
+                        (defaults to 64)')
+    parser.add_argument('--keep-jobs', type=int, default=1000, metavar='N',
+                        help='maximum number of finished jobs kept, with\
+                        their result (defaults to 1000)')
+    parser.add_argument('--job-ttl', type=int, default=3600, metavar='SECONDS',
+                        help='time finished jobs are kept (defaults to 3600)')
+    parser.add_argument('--catalog', metavar='DB',
+                        default=os.environ.get(CATALOG_ENV),
+                        help='record the generated torrents in this catalog\
+                        (defaults to $%s, see catalog.py)' % CATALOG_ENV)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    catalog = Catalog(args.catalog) if args.catalog else None
+    server.service = Service(args.workers, args.queue_size, args.cache_size,
+                             catalog, args.keep_jobs, args.job_ttl)
+    print("Listening on http://%s:%d/" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()